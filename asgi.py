@@ -0,0 +1,37 @@
+# stdlib
+import logging
+# libs
+# local
+from contact.clients import aclose_clients
+
+__all__ = [
+    'ContactLifespan',
+]
+
+
+class ContactLifespan:
+    """
+    ASGI middleware that handles the lifespan protocol, which Django's ASGI handler does not, so the shared HTTP and
+    LLM clients are closed on the server's event loop while it is still running when the server shuts down.
+    Wrap the project's application with it in asgi.py:
+        application = ContactLifespan(get_asgi_application())
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await self.application(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await aclose_clients()
+                except Exception as e:
+                    logging.getLogger('contact.asgi.lifespan').error(f'Could not close the shared clients: {e}')
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
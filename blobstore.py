@@ -0,0 +1,127 @@
+# stdlib
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import tempfile
+from typing import List, Optional, Sequence
+# libs
+from django.conf import settings
+from django.utils.module_loading import import_string
+# local
+
+__all__ = [
+    'FileSystemBlobStore',
+    'IMAGE_REF_PREFIX',
+    'get_blob_store',
+    'load_image',
+    'store_images',
+]
+
+# question_images entries whose first item starts with this prefix hold the digest of an image in the blob store
+# rather than the base64 encoded image itself
+IMAGE_REF_PREFIX = 'sha256:'
+
+
+class FileSystemBlobStore:
+    """
+    Content addressed storage of blobs on a filesystem. Blobs are stored once under the SHA-256 digest of their
+    content, so storing identical content again is a no-op.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def put(self, data: bytes) -> str:
+        """
+        Store data and return its digest
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partly written blob
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self._path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+_blob_store = None
+
+
+def get_blob_store():
+    """
+    Return the blob store configured by the CONTACT_BLOB_STORE and CONTACT_BLOB_STORE_ROOT settings, or None when no
+    root is configured.
+    The root must be storage shared by every worker of every pod, as images stored by one are read by the others.
+    """
+    global _blob_store
+    if _blob_store is None:
+        root = getattr(settings, 'CONTACT_BLOB_STORE_ROOT', None)
+        if not root:
+            return None
+        store_class = import_string(getattr(settings, 'CONTACT_BLOB_STORE', 'contact.blobstore.FileSystemBlobStore'))
+        _blob_store = store_class(root)
+    return _blob_store
+
+
+def store_images(images: Sequence[Sequence[str]]) -> List[List[str]]:
+    """
+    Store the content of (base64 image, image mime, image name) items in the blob store, returning the items with the
+    base64 image replaced by its reference. Items that are already references are returned unchanged.
+    When no blob store is configured the images are returned as they are, to be kept inline in the QAndA record.
+    """
+    store = get_blob_store()
+    if store is None:
+        return [list(image) for image in images or []]
+    stored = []
+    for image in images or []:
+        data, mime, name = (list(image) + ['', ''])[:3]
+        if not str(data).startswith(IMAGE_REF_PREFIX):
+            try:
+                data = f'{IMAGE_REF_PREFIX}{store.put(base64.b64decode(data))}'
+            except (binascii.Error, TypeError, ValueError):
+                logging.getLogger('contact.blobstore.store_images').error(
+                    f'Image {name} is not valid base64 and was not stored.',
+                )
+                continue
+        stored.append([data, mime, name])
+    return stored
+
+
+def load_image(image: Sequence[str]) -> Optional[List[str]]:
+    """
+    Resolve a question_images item to (base64 image, image mime, image name). Items stored before images moved to the
+    blob store hold the base64 image directly and are returned as they are.
+    """
+    data, mime, name = (list(image) + ['', ''])[:3]
+    if not str(data).startswith(IMAGE_REF_PREFIX):
+        return [data, mime, name]
+    store = get_blob_store()
+    content = None if store is None else store.get(data[len(IMAGE_REF_PREFIX):])
+    if content is None:
+        logging.getLogger('contact.blobstore.load_image').error(f'Image {data} was not found in the blob store.')
+        return None
+    return [base64.b64encode(content).decode('ascii'), mime, name]
@@ -0,0 +1,180 @@
+# stdlib
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+# libs
+# local
+
+__all__ = [
+    'AsyncTTLCache',
+    'FRESH',
+    'MISS',
+    'STALE',
+    'TTLCache',
+]
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+
+class TTLCache:
+    """
+    A thread safe in-process cache with least recently used eviction and a time to live for each entry.
+    Entries older than `ttl` seconds but younger than `ttl + stale_ttl` seconds are stale; they can still be served
+    by callers that are willing to refresh them.
+    When `maxbytes` is given, entries are also evicted to keep the total of the sizes passed to `set` within it.
+    When `sliding` is True the time to live restarts each time an entry is read, so entries expire once idle.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float,
+        stale_ttl: float = 0,
+        maxbytes: Optional[int] = None,
+        sliding: bool = False,
+    ):
+        self.name = name
+        self.sliding = sliding
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: 'OrderedDict[Hashable, Tuple[Any, float]]' = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def lookup(self, key: Hashable) -> Tuple[Any, str]:
+        """
+        Find the value stored for key, returning it along with whether it is FRESH, STALE or a MISS
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None, MISS
+            value, stored = item
+            age = now - stored
+            if age > self.ttl + self.stale_ttl:
+                self._remove(key)
+                self.misses += 1
+                return None, MISS
+            self._data.move_to_end(key)
+            if age > self.ttl:
+                self.stale_hits += 1
+                return value, STALE
+            if self.sliding:
+                self._data[key] = (value, now)
+            self.hits += 1
+            return value, FRESH
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the fresh value stored for key, or default
+        """
+        value, state = self.lookup(key)
+        return value if state == FRESH else default
+
+    def set(self, key: Hashable, value: Any, size: int = 0):
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, time.monotonic())
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        if self._data.pop(key, None) is not None:
+            self.bytes -= self._sizes.pop(key, 0)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Remove every entry whose key matches the predicate, returning how many were removed
+        """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'bytes': self.bytes,
+        }
+
+
+class AsyncTTLCache(TTLCache):
+    """
+    A TTLCache that fills itself from an async fetch function.
+    Concurrent misses for the same key share one fetch, and stale entries are served straight away while a single
+    background fetch refreshes them.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, stale_ttl: float = 0):
+        super().__init__(name, maxsize, ttl, stale_ttl)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            return task
+
+        async def run():
+            try:
+                value = await fetch()
+                # A fetch that returns None has failed, and is retried by the next caller instead of being cached
+                if value is not None:
+                    self.set(key, value)
+                return value
+            finally:
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+
+        task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        return task
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        value, state = self.lookup(key)
+        if state == FRESH:
+            return value
+        if state == STALE:
+            self._fetch(key, fetch).add_done_callback(self._log_refresh_error)
+            return value
+        return await asyncio.shield(self._fetch(key, fetch))
+
+    def _log_refresh_error(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.getLogger('contact.cache.AsyncTTLCache').error(
+                f'Background refresh of the {self.name} cache failed: {task.exception()}',
+            )
@@ -0,0 +1,153 @@
+# stdlib
+import copy
+import threading
+from typing import Dict, List, Optional
+# libs
+from django.conf import settings
+# local
+from contact.cache import FRESH, STALE, TTLCache
+from contact.database import run_db
+from contact.db_router import PRIMARY
+from contact.invalidation import publish, register
+from contact.models import Chatbot
+
+__all__ = [
+    'CHATBOT_CACHE',
+    'chatbot_keys',
+    'invalidate_chatbot',
+]
+
+
+class ChatbotCache:
+    """
+    Per worker cache of Chatbot records by id, with the id of each Chatbot name.
+    Records are served without a query for CHATBOT_CACHE_TTL seconds. After that, and for up to
+    CHATBOT_CACHE_STALE_TTL seconds, they are served once a query for only the Chatbot's `updated` timestamp shows they
+    have not changed, so other workers' changes are picked up without reading the full record again.
+    Writes invalidate records straight away in this worker and through the invalidation bus in the others, and bump a
+    version so a record read before the write is not cached after it.
+    Callers get their own copy of the cached record, so changing it does not change the cache.
+    """
+
+    def __init__(self):
+        self.records = TTLCache(
+            'chatbots',
+            maxsize=getattr(settings, 'CHATBOT_CACHE_SIZE', 1024),
+            ttl=getattr(settings, 'CHATBOT_CACHE_TTL', 30),
+            stale_ttl=getattr(settings, 'CHATBOT_CACHE_STALE_TTL', 3600),
+        )
+        self.ids = TTLCache(
+            'chatbot_ids',
+            maxsize=getattr(settings, 'CHATBOT_CACHE_SIZE', 1024),
+            ttl=getattr(settings, 'CHATBOT_CACHE_STALE_TTL', 3600),
+        )
+        self.version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def _pk(self, pk: Optional[int], name: Optional[str]) -> Optional[int]:
+        if pk is not None:
+            return int(pk)
+        return self.ids.get(name)
+
+    def _load(self, pk: Optional[int], name: Optional[str]) -> Chatbot:
+        self.misses += 1
+        version = self.version
+        filters = {'pk': pk} if pk is not None else {'name': name}
+        # Always read from the primary, a lagging replica could fill the cache with a record that was just invalidated
+        chatbot = Chatbot.objects.using(PRIMARY).get(**filters)
+        with self._lock:
+            # Only cache the record if nothing was invalidated while it was being read
+            if self.version == version:
+                self.records.set(chatbot.pk, chatbot)
+                self.ids.set(chatbot.name, chatbot.pk)
+        return chatbot
+
+    def _fresh(self, pk: Optional[int], name: Optional[str]):
+        """
+        Return the cached record and its state without running any queries
+        """
+        pk = self._pk(pk, name)
+        if pk is None:
+            return None, None
+        chatbot, state = self.records.lookup(pk)
+        if chatbot is not None and name is not None and chatbot.name != name:
+            return None, None
+        return chatbot, state
+
+    def get(self, name: Optional[str] = None, pk: Optional[int] = None) -> Chatbot:
+        """
+        Get the Chatbot by name or id, like Chatbot.objects.get. Raises Chatbot.DoesNotExist if there is none. May
+        run database queries.
+        """
+        chatbot, state = self._fresh(pk, name)
+        if state == FRESH:
+            self.hits += 1
+            return copy.copy(chatbot)
+        if state == STALE:
+            version = self.version
+            updated = Chatbot.objects.using(PRIMARY).filter(pk=chatbot.pk).values_list('updated', flat=True).first()
+            if updated is not None and updated == chatbot.updated:
+                self.revalidations += 1
+                with self._lock:
+                    if self.version == version:
+                        self.records.set(chatbot.pk, chatbot)
+                return copy.copy(chatbot)
+        return copy.copy(self._load(pk, name))
+
+    async def aget(self, name: Optional[str] = None, pk: Optional[int] = None) -> Chatbot:
+        """
+        Get the Chatbot by name or id from an async view, only leaving the event loop when a query is needed
+        """
+        chatbot, state = self._fresh(pk, name)
+        if state == FRESH:
+            self.hits += 1
+            return copy.copy(chatbot)
+        return await run_db(self.get, name=name, pk=pk)
+
+    def invalidate(self, pk: int, name: Optional[str] = None):
+        with self._lock:
+            self.version += 1
+            self.records.delete(pk)
+            if name is not None:
+                self.ids.delete(name)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self.records.clear()
+            self.ids.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.revalidations + self.misses
+        return {
+            'hits': self.hits,
+            'revalidations': self.revalidations,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.revalidations) / lookups, 4) if lookups else 0.0,
+            'size': self.records.stats()['size'],
+        }
+
+
+CHATBOT_CACHE = ChatbotCache()
+register('chatbot', lambda pk: CHATBOT_CACHE.invalidate(int(pk)), CHATBOT_CACHE.clear)
+register('chatbot_name', lambda name: CHATBOT_CACHE.ids.delete(name))
+
+
+def chatbot_keys(chatbot: Chatbot, previous_name: Optional[str] = None) -> List[str]:
+    """
+    Invalidation keys of the cached record of the Chatbot, and of the name it had before a change if it was renamed
+    """
+    keys = [f'chatbot:{chatbot.pk}', f'chatbot_name:{chatbot.name}']
+    if previous_name is not None and previous_name != chatbot.name:
+        keys.append(f'chatbot_name:{previous_name}')
+    return keys
+
+
+def invalidate_chatbot(chatbot: Chatbot, previous_name: Optional[str] = None):
+    """
+    Drop the cached record of the Chatbot in every worker after it has been changed or deleted
+    """
+    publish(*chatbot_keys(chatbot, previous_name))
@@ -0,0 +1,218 @@
+# stdlib
+import asyncio
+import atexit
+import logging
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+# libs
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+# local
+
+__all__ = [
+    'aclose_clients',
+    'aclose_embedding_db_client',
+    'aclose_llm_clients',
+    'get_embedding_db_client',
+    'llm_client',
+    'llm_client_stats',
+]
+
+
+# One client per running event loop. httpx connections are bound to the loop that opened them, so a worker that
+# runs a single loop (uvicorn) ends up with exactly one shared, keep-alive client.
+_EMBEDDING_DB_CLIENTS: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]' = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _limits() -> httpx.Limits:
+    """
+    Connection pool limits for the async clients, taken from settings so they can be tuned per environment
+    """
+    return httpx.Limits(
+        max_connections=int(getattr(settings, 'EMBEDDING_DB_MAX_CONNECTIONS', 100)),
+        max_keepalive_connections=int(getattr(settings, 'EMBEDDING_DB_MAX_KEEPALIVE_CONNECTIONS', 20)),
+        keepalive_expiry=float(getattr(settings, 'EMBEDDING_DB_KEEPALIVE_EXPIRY', 30)),
+    )
+
+
+def get_embedding_db_client() -> httpx.AsyncClient:
+    """
+    Return the shared httpx.AsyncClient used to talk to the Embedding DB API from the running event loop.
+    The client keeps connections alive between requests, negotiates HTTP/2 when enabled and accepts compressed
+    responses.
+    """
+    loop = asyncio.get_running_loop()
+    client = _EMBEDDING_DB_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=bool(getattr(settings, 'EMBEDDING_DB_HTTP2', True)),
+            limits=_limits(),
+            timeout=httpx.Timeout(600, connect=10),
+            headers={'Accept-Encoding': 'gzip, deflate'},
+        )
+        _EMBEDDING_DB_CLIENTS[loop] = client
+    return client
+
+
+async def aclose_embedding_db_client():
+    """
+    Close the Embedding DB client of the running event loop, if one has been created
+    """
+    client = _EMBEDDING_DB_CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        logging.getLogger('contact.clients.aclose_embedding_db_client').info('Closing Embedding DB client')
+        await client.aclose()
+
+
+class _LLMClientPool:
+    """
+    LRU bounded registry of AsyncOpenAI clients for one event loop, keyed by API key and base URL.
+    Clients are counted while in use, so a client evicted from the registry is only closed once the last request using
+    it, i.e. streaming an answer from it, has released it.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.clients: 'OrderedDict[Tuple[str, str], AsyncOpenAI]' = OrderedDict()
+        self.users: Dict[AsyncOpenAI, int] = {}
+        # Clients evicted while in use, closed when released
+        self.retired: Set[AsyncOpenAI] = set()
+
+    def acquire(self, api_key: str, base_url: str) -> Tuple[AsyncOpenAI, bool]:
+        client, reused = self._get(api_key, base_url)
+        self.users[client] = self.users.get(client, 0) + 1
+        return client, reused
+
+    def release(self, client: AsyncOpenAI):
+        users = self.users.pop(client, 1) - 1
+        if users > 0:
+            self.users[client] = users
+        elif client in self.retired:
+            self.retired.discard(client)
+            self.loop.create_task(client.close())
+
+    def _get(self, api_key: str, base_url: str) -> Tuple[AsyncOpenAI, bool]:
+        key = (api_key, base_url)
+        client = self.clients.get(key)
+        if client is not None and not client.is_closed():
+            self.clients.move_to_end(key)
+            _LLM_CLIENT_STATS['hits'] += 1
+            return client, True
+
+        _LLM_CLIENT_STATS['misses'] += 1
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=DefaultAsyncHttpxClient(
+                http2=bool(getattr(settings, 'LLM_HTTP2', True)),
+                limits=httpx.Limits(
+                    max_connections=int(getattr(settings, 'LLM_MAX_CONNECTIONS', 100)),
+                    max_keepalive_connections=int(getattr(settings, 'LLM_MAX_KEEPALIVE_CONNECTIONS', 20)),
+                    keepalive_expiry=float(getattr(settings, 'LLM_KEEPALIVE_EXPIRY', 60)),
+                ),
+            ),
+        )
+        self.clients[key] = client
+
+        max_size = int(getattr(settings, 'LLM_CLIENT_POOL_SIZE', 32))
+        while len(self.clients) > max_size:
+            _, evicted = self.clients.popitem(last=False)
+            _LLM_CLIENT_STATS['evictions'] += 1
+            if self.users.get(evicted, 0) > 0:
+                self.retired.add(evicted)
+            else:
+                self.loop.create_task(evicted.close())
+        return client, False
+
+    async def aclose(self):
+        clients = list(self.clients.values()) + list(self.retired)
+        self.clients.clear()
+        self.retired.clear()
+        for client in clients:
+            await client.close()
+
+
+_LLM_CLIENT_POOLS: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LLMClientPool]' = (
+    weakref.WeakKeyDictionary()
+)
+_LLM_CLIENT_STATS: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+@asynccontextmanager
+async def llm_client(api_key: str, base_url: Optional[str] = None) -> AsyncIterator[Tuple[AsyncOpenAI, bool]]:
+    """
+    Use a pooled AsyncOpenAI client for the API key and base URL, creating it if needed, for the duration of the block.
+    Everything done with the client, including reading a streamed response, must happen inside the block.
+    The second value given states whether an existing client (and its open connections) was reused.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _LLM_CLIENT_POOLS.get(loop)
+    if pool is None:
+        pool = _LLMClientPool(loop)
+        _LLM_CLIENT_POOLS[loop] = pool
+    client, reused = pool.acquire(api_key, base_url or settings.CLOUDCIX_LLM_URL)
+    try:
+        yield client, reused
+    finally:
+        pool.release(client)
+
+
+def llm_client_stats() -> Dict[str, int]:
+    """
+    Hit, miss and eviction counters of the LLM client registry, with the number of clients currently open and of
+    evicted clients waiting for their requests to finish
+    """
+    pools = list(_LLM_CLIENT_POOLS.values())
+    return {
+        **_LLM_CLIENT_STATS,
+        'size': sum(len(pool.clients) for pool in pools),
+        'retired': sum(len(pool.retired) for pool in pools),
+    }
+
+
+async def aclose_llm_clients():
+    """
+    Close every pooled LLM client of the running event loop
+    """
+    pool = _LLM_CLIENT_POOLS.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        logging.getLogger('contact.clients.aclose_llm_clients').info(f'Closing {len(pool.clients)} LLM clients')
+        await pool.aclose()
+
+
+async def aclose_clients():
+    """
+    Close all of the shared clients of the running event loop
+    """
+    await aclose_embedding_db_client()
+    await aclose_llm_clients()
+
+
+@atexit.register
+def _close_clients_at_exit():  # pragma: no cover
+    """
+    On interpreter shutdown, close the clients of any event loop that is still usable. Under uvicorn the loop is
+    already closed by then, so the clients are closed by ContactLifespan when the server shuts down.
+    """
+    loops = set(_EMBEDDING_DB_CLIENTS.keys()) | set(_LLM_CLIENT_POOLS.keys())
+    for loop in loops:
+        if loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(_aclose_loop_clients(loop))
+        except Exception:
+            continue
+
+
+async def _aclose_loop_clients(loop: asyncio.AbstractEventLoop):  # pragma: no cover
+    client = _EMBEDDING_DB_CLIENTS.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+    pool = _LLM_CLIENT_POOLS.pop(loop, None)
+    if pool is not None:
+        await pool.aclose()
@@ -72,6 +72,7 @@ class ChatbotCreateController(ControllerBase):
             'button_background_colour',
             'button_text',
             'button_text_colour',
+            'cache_responses',
             'chatbot_header_title',
             'chatbot_header_description',
             'chunk_overlap',
@@ -89,10 +90,12 @@ class ChatbotCreateController(ControllerBase):
             'name',
             'nn_llm',
             'pdf_scraping',
+            'prefix_cache_layout',
             'reference_limit',
             'no_reference_answer',
             'reranker',
             'reranking_limit',
+            'semantic_cache_threshold',
             'similarity',
             'smalltalk_prompt',
             'rewrite_prompt',
@@ -254,6 +257,21 @@ class ChatbotCreateController(ControllerBase):
         self.cleaned_data['button_text_colour'] = button_text_colour
         return None
 
+    def validate_cache_responses(self, cache_responses: Optional[bool]) -> Optional[str]:
+        """
+        description: |
+            If True, answers generated by the LLM are cached and replayed when the exact same prompt is sent again.
+            Intended for Chatbots with a temperature of 0, where the same prompt produces the same answer.
+        required: false
+        type: boolean
+        """
+        if cache_responses is None:
+            return None
+        if not isinstance(cache_responses, bool):
+            return 'contact_chatbot_create_171'
+        self.cleaned_data['cache_responses'] = cache_responses
+        return None
+
     def validate_chatbot_header_title(self, chatbot_header_title: Optional[str]) -> Optional[str]:
         """
         description: |
@@ -555,6 +573,22 @@ class ChatbotCreateController(ControllerBase):
         self.cleaned_data['pdf_scraping'] = pdf_scraping
         return None
 
+    def validate_prefix_cache_layout(self, prefix_cache_layout: Optional[bool]) -> Optional[str]:
+        """
+        description: |
+            If True, the prompt sent to the LLM is laid out to keep its start the same from turn to turn, so the LLM
+            service can reuse its cache of a previous prompt. The system prompt comes first, then the Conversation
+            history from oldest to newest, with the date, retrieved references and question at the end.
+        required: false
+        type: boolean
+        """
+        if prefix_cache_layout is None:
+            return None
+        if not isinstance(prefix_cache_layout, bool):
+            return 'contact_chatbot_create_174'
+        self.cleaned_data['prefix_cache_layout'] = prefix_cache_layout
+        return None
+
     def validate_reference_limit(self, reference_limit: int) -> Optional[str]:
         """
         description: Number of references between 1 and 10
@@ -603,6 +637,29 @@ class ChatbotCreateController(ControllerBase):
         self.cleaned_data['reranking_limit'] = reranking_limit
         return None
 
+    def validate_semantic_cache_threshold(self, semantic_cache_threshold: Optional[Decimal]) -> Optional[str]:
+        """
+        description: |
+            The similarity, between 0 and 1, a first question in a Conversation must have with a previously answered
+            first question for the previous answer to be returned without retrieval or calling the LLM. A value of 0
+            disables the semantic cache.
+        required: false
+        type: string
+        format: decimal
+        """
+        if semantic_cache_threshold is None:
+            return None
+        try:
+            semantic_cache_threshold = Decimal(str(semantic_cache_threshold))
+        except (ValueError, TypeError, InvalidOperation):
+            return 'contact_chatbot_create_172'
+
+        if semantic_cache_threshold < 0 or semantic_cache_threshold > 1:
+            return 'contact_chatbot_create_173'
+
+        self.cleaned_data['semantic_cache_threshold'] = semantic_cache_threshold
+        return None
+
     def validate_similarity(self, similarity: Optional[str]) -> Optional[str]:
         """
         description: The Vector Similarity formula for the retrieval of Embeddings for the chatbot
@@ -860,6 +917,7 @@ class ChatbotUpdateController(ControllerBase):
             'button_background_colour',
             'button_text',
             'button_text_colour',
+            'cache_responses',
             'chatbot_header_title',
             'chatbot_header_description',
             'chunk_overlap',
@@ -877,9 +935,11 @@ class ChatbotUpdateController(ControllerBase):
             'name',
             'nn_llm',
             'pdf_scraping',
+            'prefix_cache_layout',
             'reference_limit',
             'reranker',
             'reranking_limit',
+            'semantic_cache_threshold',
             'similarity',
             'smalltalk_prompt',
             'rewrite_prompt',
@@ -1041,6 +1101,21 @@ class ChatbotUpdateController(ControllerBase):
         self.cleaned_data['button_text_colour'] = button_text_colour
         return None
 
+    def validate_cache_responses(self, cache_responses: Optional[bool]) -> Optional[str]:
+        """
+        description: |
+            If True, answers generated by the LLM are cached and replayed when the exact same prompt is sent again.
+            Intended for Chatbots with a temperature of 0, where the same prompt produces the same answer.
+        required: false
+        type: boolean
+        """
+        if cache_responses is None:
+            return None
+        if not isinstance(cache_responses, bool):
+            return 'contact_chatbot_update_170'
+        self.cleaned_data['cache_responses'] = cache_responses
+        return None
+
     def validate_chatbot_header_title(self, chatbot_header_title: Optional[str]) -> Optional[str]:
         """
         description: |
@@ -1342,6 +1417,22 @@ class ChatbotUpdateController(ControllerBase):
         self.cleaned_data['pdf_scraping'] = pdf_scraping
         return None
 
+    def validate_prefix_cache_layout(self, prefix_cache_layout: Optional[bool]) -> Optional[str]:
+        """
+        description: |
+            If True, the prompt sent to the LLM is laid out to keep its start the same from turn to turn, so the LLM
+            service can reuse its cache of a previous prompt. The system prompt comes first, then the Conversation
+            history from oldest to newest, with the date, retrieved references and question at the end.
+        required: false
+        type: boolean
+        """
+        if prefix_cache_layout is None:
+            return None
+        if not isinstance(prefix_cache_layout, bool):
+            return 'contact_chatbot_update_173'
+        self.cleaned_data['prefix_cache_layout'] = prefix_cache_layout
+        return None
+
     def validate_reference_limit(self, reference_limit: int) -> Optional[str]:
         """
         description: Number of references between 1 and 10
@@ -1390,6 +1481,29 @@ class ChatbotUpdateController(ControllerBase):
         self.cleaned_data['reranking_limit'] = reranking_limit
         return None
 
+    def validate_semantic_cache_threshold(self, semantic_cache_threshold: Optional[Decimal]) -> Optional[str]:
+        """
+        description: |
+            The similarity, between 0 and 1, a first question in a Conversation must have with a previously answered
+            first question for the previous answer to be returned without retrieval or calling the LLM. A value of 0
+            disables the semantic cache.
+        required: false
+        type: string
+        format: decimal
+        """
+        if semantic_cache_threshold is None:
+            return None
+        try:
+            semantic_cache_threshold = Decimal(str(semantic_cache_threshold))
+        except (ValueError, TypeError, InvalidOperation):
+            return 'contact_chatbot_update_171'
+
+        if semantic_cache_threshold < 0 or semantic_cache_threshold > 1:
+            return 'contact_chatbot_update_172'
+
+        self.cleaned_data['semantic_cache_threshold'] = semantic_cache_threshold
+        return None
+
     def validate_similarity(self, similarity: Optional[str]) -> Optional[str]:
         """
         description: The Vector Similarity formula for the retrieval of Embeddings for the chatbot
@@ -0,0 +1,102 @@
+# stdlib
+import threading
+import time
+from typing import Callable, Dict, TypeVar
+# libs
+from asgiref.sync import sync_to_async
+from django.db import connections
+# local
+
+__all__ = [
+    'database_stats',
+    'pool_stats',
+    'run_db',
+]
+
+T = TypeVar('T')
+
+# Counters of the psycopg connection pools reported by pool_stats
+POOL_STATS = (
+    'pool_min',
+    'pool_max',
+    'pool_size',
+    'pool_available',
+    'requests_waiting',
+    'requests_num',
+    'requests_queued',
+    'requests_wait_ms',
+    'requests_errors',
+    'returns_bad',
+    'connections_num',
+    'connections_errors',
+    'connections_lost',
+)
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.busy = 0
+        self.max_busy = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def started(self, queued: float):
+        wait = time.monotonic() - queued
+        with self._lock:
+            self.calls += 1
+            self.busy += 1
+            self.max_busy = max(self.max_busy, self.busy)
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def finished(self):
+        with self._lock:
+            self.busy -= 1
+
+
+_STATS = _Stats()
+
+
+def _call(queued: float, function: Callable[..., T], *args, **kwargs) -> T:
+    _STATS.started(queued)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _STATS.finished()
+
+
+async def run_db(function: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Run the sync function, which uses the database, from an async view.
+    Django's ASGI handler gives each request its own thread for thread sensitive calls, so the database work of
+    concurrent requests runs in parallel, while all of the calls of one request share its thread and its connection,
+    which is closed when the request finishes. Everything that has to happen in one transaction must happen in one call.
+    """
+    return await sync_to_async(_call, thread_sensitive=True)(time.monotonic(), function, *args, **kwargs)
+
+
+def database_stats() -> Dict[str, float]:
+    return {
+        'calls': _STATS.calls,
+        'busy': _STATS.busy,
+        'max_busy': _STATS.max_busy,
+        'avg_wait_seconds': round(_STATS.wait_seconds / _STATS.calls, 4) if _STATS.calls else 0.0,
+        'max_wait_seconds': round(_STATS.max_wait_seconds, 4),
+    }
+
+
+def pool_stats(alias: str = 'contact') -> Dict[str, float]:
+    """
+    Size and wait time counters of the connection pool of the database, empty when it is not pooled
+    """
+    pool = getattr(connections[alias], 'pool', None)
+    if pool is None:
+        return {}
+    stats = pool.get_stats()
+    # psycopg_pool leaves out counters that are still zero
+    values = {stat: stats.get(stat, 0) for stat in POOL_STATS}
+    requests = values['requests_num']
+    values['avg_wait_ms'] = round(values['requests_wait_ms'] / requests, 3) if requests else 0.0
+    return values
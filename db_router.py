@@ -10,19 +10,192 @@ for various operations
 - Migrations
 
 This stuff could be used when it comes to sharding out the DBs too.
+
+Reads of views decorated with `replica_reads` go to the `contact_replica` DB when it is configured, for requests that
+pass through ReplicaClientMiddleware, unless the client wrote to the contact DB within CONTACT_REPLICA_STICKY_SECONDS
+or the replica lags by more than CONTACT_REPLICA_MAX_LAG seconds.
 """
 
 # stdlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Any, Dict, Optional, Type
 # libs
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.db import connections
 from django.db.models import Model
+# local
+
+__all__ = [
+    'ContactRouter',
+    'PRIMARY',
+    'ReplicaClientMiddleware',
+    'replica_reads',
+]
+
+PRIMARY = 'contact'
+REPLICA = 'contact_replica'
+
+# Seconds the replica is behind the primary, 0 when it has replayed everything it was sent or is not in recovery
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# The cookie, and header for clients that do not keep cookies, that tell the client to send its following requests
+# to the primary. Any worker in any pod can check its signature, so the window holds whichever one serves the requests.
+PRIMARY_UNTIL_COOKIE = 'contact_primary_until'
+PRIMARY_UNTIL_HEADER = 'X-Contact-Primary-Until'
+PRIMARY_UNTIL_SALT = 'contact.db_router.primary_until'
+
+
+class _Client:
+    """
+    What ReplicaClientMiddleware knows about the client of the current request
+    """
+
+    def __init__(self, sticky: bool):
+        # Whether the client wrote within the sticky window
+        self.sticky = sticky
+        self.wrote = False
+
+
+# Whether the current request may read from the replica, and its client
+_replica_reads: ContextVar[bool] = ContextVar('contact_replica_reads', default=False)
+_client: ContextVar[Optional[_Client]] = ContextVar('contact_replica_client', default=None)
+
+
+def _sticky_seconds() -> float:
+    return getattr(settings, 'CONTACT_REPLICA_STICKY_SECONDS', 5)
+
+
+def _is_sticky(request) -> bool:
+    """
+    Whether the request carries a valid primary-until value signed within the sticky window
+    """
+    value = request.COOKIES.get(PRIMARY_UNTIL_COOKIE) or request.headers.get(PRIMARY_UNTIL_HEADER)
+    if not value:
+        return False
+    try:
+        signing.TimestampSigner(salt=PRIMARY_UNTIL_SALT).unsign(value, max_age=_sticky_seconds())
+    except signing.BadSignature:
+        # Expired values are bad signatures too
+        return False
+    return True
+
+
+def _stick(response):
+    """
+    Tell the client of a request that wrote to read from the primary for the sticky window
+    """
+    seconds = _sticky_seconds()
+    value = signing.TimestampSigner(salt=PRIMARY_UNTIL_SALT).sign('primary')
+    response.set_cookie(PRIMARY_UNTIL_COOKIE, value, max_age=seconds, secure=True, httponly=True, samesite='Lax')
+    response[PRIMARY_UNTIL_HEADER] = value
+
+
+class ReplicaClientMiddleware:
+    """
+    Keep the reads of a client on the primary for CONTACT_REPLICA_STICKY_SECONDS after it writes, so it reads its own
+    writes. The response of a request that wrote sets a signed cookie, and header, that the following requests of the
+    client send back. Requests that do not pass through this middleware never read from the replica.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        client = _Client(_is_sticky(request))
+        token = _client.set(client)
+        try:
+            response = self.get_response(request)
+        finally:
+            _client.reset(token)
+        if client.wrote:
+            _stick(response)
+        return response
+
+    async def __acall__(self, request):
+        client = _Client(_is_sticky(request))
+        token = _client.set(client)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _client.reset(token)
+        if client.wrote:
+            _stick(response)
+        return response
+
+
+@contextmanager
+def replica_reads():
+    """
+    Allow the reads made inside the block, or the decorated view method, to be routed to the replica
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
 
 
 class ContactRouter:
     """
-    This class controls Django's DB functionality to ensure that all contact models get routed to the contact DB
+    This class controls Django's DB functionality to ensure that all contact models get routed to the contact DB, or
+    for reads allowed by `replica_reads`, to its replica
     """
 
+    def __init__(self):
+        self._lag_lock = threading.Lock()
+        self._lag: Optional[float] = None
+        self._lag_checked = float('-inf')
+
+    def _replica_lag(self) -> Optional[float]:
+        """
+        Return the lag of the replica, checked at most once every CONTACT_REPLICA_LAG_CHECK_INTERVAL seconds, or None
+        if it could not be checked
+        """
+        interval = getattr(settings, 'CONTACT_REPLICA_LAG_CHECK_INTERVAL', 5)
+        # Only one thread checks, the others use the last value in the meantime
+        if time.monotonic() - self._lag_checked < interval or not self._lag_lock.acquire(blocking=False):
+            return self._lag
+        try:
+            with connections[REPLICA].cursor() as cursor:
+                cursor.execute(LAG_QUERY)
+                self._lag = float(cursor.fetchone()[0])
+        except Exception as e:
+            self._lag = None
+            logging.getLogger('contact.db_router.replica_lag').warning(
+                f'Could not check the lag of {REPLICA}, reading from contact: {e}',
+            )
+        finally:
+            self._lag_checked = time.monotonic()
+            self._lag_lock.release()
+        return self._lag
+
+    def _use_replica(self) -> bool:
+        if not _replica_reads.get() or REPLICA not in settings.DATABASES:
+            return False
+        client = _client.get()
+        if client is None or client.sticky or client.wrote:
+            # Read your own writes
+            return False
+        lag = self._replica_lag()
+        return lag is not None and lag <= getattr(settings, 'CONTACT_REPLICA_MAX_LAG', 2)
+
     def db_for_read(self, model: Type[Model], **hints: Dict[str, Any]) -> Optional[str]:
         """
         Specifies the DB to use to read objects of the specified Model
@@ -31,7 +204,7 @@ class ContactRouter:
         :return: The name of the DB to route reads to
         """
         if model._meta.app_label == 'contact':
-            return 'contact'
+            return REPLICA if self._use_replica() else PRIMARY
         # We don't read from any other DB during test so we can safely ignore this line from coverage
         return None  # pragma: no cover
 
@@ -43,7 +216,10 @@ class ContactRouter:
         :return: The name of the DB to route writes to
         """
         if model._meta.app_label == 'contact':
-            return 'contact'
+            client = _client.get()
+            if client is not None:
+                client.wrote = True
+            return PRIMARY
         return None  # pragma: no cover
 
     def allow_relation(self, model1: Type[Model], model2: Type[Model], **hints: Dict[str, Any]) -> Optional[bool]:
@@ -65,4 +241,7 @@ class ContactRouter:
         :param hints: Any hints that can be given to help the decision
         :return: A flag that states whether the migration is allowed
         """
+        if db == REPLICA:
+            # The replica gets its schema from the primary
+            return False
         return True if app_label == 'contact' and db == 'contact' else None
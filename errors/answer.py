@@ -12,4 +12,7 @@ contact_answer_create_003 = (
     'The send "conversation_id" parameter in data is invalid. "conversation_id" must belong to a valid Conversation '
     'record in the Chatbot.'
 )
+contact_answer_create_004 = (
+    'One or more of the sent "images" files is invalid. Each uploaded image file must not exceed the upload size limit.'
+)
 contact_answer_create_201 = 'You do not have Permission to make this request.'
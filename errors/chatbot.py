@@ -161,6 +161,18 @@ contact_chatbot_create_169 = (
 contact_chatbot_create_170 = (
     'The "maximum_conversation_turn" parameter is invalid. "maximum_conversation_turn" must be 0 or greater.'
 )
+contact_chatbot_create_171 = (
+    'The "cache_responses" parameter is invalid. The "cache_responses" parameter must be a boolean'
+)
+contact_chatbot_create_172 = (
+    'The "semantic_cache_threshold" parameter is invalid. "semantic_cache_threshold" must be a decimal.'
+)
+contact_chatbot_create_173 = (
+    'The "semantic_cache_threshold" parameter is invalid. "semantic_cache_threshold" must be a decimal between 0 and 1.'
+)
+contact_chatbot_create_174 = (
+    'The "prefix_cache_layout" parameter is invalid. The "prefix_cache_layout" parameter must be a boolean'
+)
 contact_chatbot_create_201 = 'You do not have permission to make this request. Your Member must be self-managed.'
 
 # Read
@@ -319,6 +331,18 @@ contact_chatbot_update_168 = (
 contact_chatbot_update_169 = (
     'The "maximum_conversation_turn" parameter is invalid. "maximum_conversation_turn" must be 0 or greater.'
 )
+contact_chatbot_update_170 = (
+    'The "cache_responses" parameter is invalid. The "cache_responses" parameter must be a boolean'
+)
+contact_chatbot_update_171 = (
+    'The "semantic_cache_threshold" parameter is invalid. "semantic_cache_threshold" must be a decimal.'
+)
+contact_chatbot_update_172 = (
+    'The "semantic_cache_threshold" parameter is invalid. "semantic_cache_threshold" must be a decimal between 0 and 1.'
+)
+contact_chatbot_update_173 = (
+    'The "prefix_cache_layout" parameter is invalid. The "prefix_cache_layout" parameter must be a boolean'
+)
 contact_chatbot_update_001 = 'The "pk" path parameter is invalid. "pk" must belong to a valid Chatbot record.'
 # Delete
 contact_chatbot_delete_001 = 'The "pk" path parameters is invalid. "pk" must belong to a valid Chatbot record.'
@@ -0,0 +1,187 @@
+# stdlib
+import threading
+from typing import Dict, List, Optional
+# libs
+from django.conf import settings
+# local
+from contact.blobstore import load_image
+from contact.cache import TTLCache
+from contact.invalidation import publish, register
+from contact.tokens import count_tokens
+
+__all__ = [
+    'HISTORY_CACHE',
+    'Turn',
+    'append_turn',
+    'get_history',
+    'invalidate_history',
+]
+
+
+class Turn:
+    """
+    A question and answer of a Conversation, with its token counts and its prompt messages without images memoised.
+    Messages with images are built each time they are needed, so the cache does not hold the loaded image data.
+    """
+    __slots__ = ('question', 'answer', 'question_images', '_tokens', '_messages')
+
+    def __init__(self, question: str, answer: str, question_images: Optional[List]):
+        self.question = question
+        self.answer = answer
+        self.question_images = question_images or []
+        self._tokens: Dict[Optional[str], int] = {}
+        self._messages: Optional[List[Dict]] = None
+
+    def tokens(self, model: Optional[str] = None) -> int:
+        """
+        The number of tokens in the question and answer of this turn for the model, not counting images
+        """
+        tokens = self._tokens.get(model)
+        if tokens is None:
+            tokens = count_tokens(self.question, model) + count_tokens(self.answer, model)
+            self._tokens[model] = tokens
+        return tokens
+
+    def messages(self, with_images: bool = True) -> List[Dict]:
+        """
+        The user and assistant messages of this turn in the format sent to the LLM
+        """
+        with_images = with_images and len(self.question_images) > 0
+        messages = None if with_images else self._messages
+        if messages is None:
+            if with_images:
+                images = [image for image in map(load_image, self.question_images) if image is not None]
+                user_content = [
+                    {'type': 'text', 'text': self.question},
+                ] + [
+                    {
+                        'type': 'image_url',
+                        'image_url': {
+                            'url': f'data:{image[1]};base64,{image[0]}',
+                            # https://platform.openai.com/docs/guides/images-vision?api-mode=chat&format=base64-encoded#analyze-images
+                        },
+                    }
+                    for image in images
+                ]
+            else:
+                user_content = self.question
+            messages = [
+                {'role': 'user', 'content': user_content},
+                {'role': 'assistant', 'content': self.answer},
+            ]
+            if not with_images:
+                self._messages = messages
+        return messages
+
+    def size(self) -> int:
+        """
+        Approximate number of bytes held by this turn, counting images stored inline in the QAndA record
+        """
+        return (
+            len(self.question or '')
+            + len(self.answer or '')
+            + sum(len(str(image[0])) for image in self.question_images if image)
+        )
+
+    def rewrite_line(self) -> str:
+        """
+        This turn as a line of the chat history sent to the prompt rewriter
+        """
+        return f'User: {self.question}\nChatbot: {self.answer}\n'
+
+
+class _ConversationHistory:
+    """
+    The newest turns of a Conversation, oldest first, and how many turns it has, as of its last_message_at
+    """
+    __slots__ = ('turns', 'complete', 'count', 'last_message_at', 'lock')
+
+    def __init__(self, turns: List[Turn], complete: bool, count: int, last_message_at):
+        self.turns = turns
+        self.complete = complete
+        self.count = count
+        self.last_message_at = last_message_at
+        self.lock = threading.Lock()
+
+    def size(self) -> int:
+        return sum(turn.size() for turn in self.turns)
+
+
+# Formatted history per Conversation id. Entries expire after they have not been used for HISTORY_CACHE_IDLE_TTL,
+# and the least recently used are evicted to keep the cache within HISTORY_CACHE_MAX_BYTES
+HISTORY_CACHE = TTLCache(
+    'conversation_history',
+    maxsize=getattr(settings, 'HISTORY_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'HISTORY_CACHE_IDLE_TTL', 1800),
+    maxbytes=getattr(settings, 'HISTORY_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+    sliding=True,
+)
+
+
+def _load(conversation, turns: int) -> _ConversationHistory:
+    rows = list(
+        conversation.questions.prefetch_related(None).order_by('-created').values_list(
+            'question',
+            'answer',
+            'question_images',
+        )[:turns],
+    )
+    complete = len(rows) < turns
+    return _ConversationHistory(
+        [Turn(question, answer, question_images) for question, answer, question_images in reversed(rows)],
+        complete,
+        len(rows) if complete else conversation.questions.count(),
+        conversation.last_message_at,
+    )
+
+
+def get_history(conversation, turns: int, block: int = 0) -> List[Turn]:
+    """
+    Return up to the newest `turns` turns of the Conversation, newest first.
+    With a block size, the oldest turn returned is always one whose position in the Conversation is a multiple of
+    block, so the same oldest turn is returned for `block` turns in a row and between `turns - block + 1` and `turns`
+    turns are returned once the Conversation is longer than `turns`.
+    The database is only read the first time a Conversation is seen by this worker, when more turns are needed than
+    are cached, or when another worker has added a turn since (the Conversation's last_message_at is newer).
+    """
+    history = HISTORY_CACHE.get(conversation.pk)
+    if (
+        history is None
+        or (not history.complete and len(history.turns) < turns)
+        or conversation.last_message_at > history.last_message_at
+    ):
+        history = _load(conversation, max(turns, getattr(settings, 'HISTORY_CACHE_TURNS', 50)))
+        HISTORY_CACHE.set(conversation.pk, history, size=history.size())
+    with history.lock:
+        if block > 0 and history.count > turns:
+            block = min(block, turns)
+            start = -(-(history.count - turns) // block) * block
+            turns = history.count - start
+        return history.turns[::-1][:turns]
+
+
+def append_turn(conversation, question: str, answer: str, question_images: Optional[List] = None):
+    """
+    Add a newly answered turn to the cached history of the Conversation, if it is cached
+    """
+    history = HISTORY_CACHE.get(conversation.pk)
+    if history is None:
+        return
+    limit = max(getattr(settings, 'HISTORY_CACHE_TURNS', 50), len(history.turns))
+    with history.lock:
+        history.turns.append(Turn(question, answer, question_images))
+        history.count += 1
+        if len(history.turns) > limit:
+            del history.turns[0]
+            history.complete = False
+        history.last_message_at = max(history.last_message_at, conversation.last_message_at)
+        size = history.size()
+    # Stored again so the size of the new turn is counted
+    HISTORY_CACHE.set(conversation.pk, history, size=size)
+
+
+def invalidate_history(conversation_id: int):
+    publish(f'history:{conversation_id}')
+
+
+register('history', lambda conversation_id: HISTORY_CACHE.delete(int(conversation_id)), HISTORY_CACHE.clear)
@@ -0,0 +1,166 @@
+# stdlib
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, List, Sequence, Tuple
+# libs
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from PIL import Image, ImageOps, UnidentifiedImageError
+# local
+from contact.cache import TTLCache
+
+__all__ = [
+    'ImageUploadHandler',
+    'aprocess_images',
+    'aprocess_uploaded_images',
+    'process_image',
+    'process_images',
+    'process_uploaded_image',
+    'process_uploaded_images',
+]
+
+# Processed images keyed by the SHA-256 digest of the original, so an image sent again is not processed again
+PROCESSED_IMAGES = TTLCache(
+    'processed_images',
+    maxsize=getattr(settings, 'IMAGE_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'IMAGE_CACHE_TTL', 3600),
+    maxbytes=getattr(settings, 'IMAGE_CACHE_MAX_BYTES', 128 * 1024 * 1024),
+)
+
+# Pillow releases the GIL while decoding, resizing and encoding so a thread pool keeps the work off the event loop
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 4),
+    thread_name_prefix='contact_images',
+)
+
+
+def _process(image_file: BinaryIO, digest: str) -> Tuple[bytes, str]:
+    processed = PROCESSED_IMAGES.get(digest)
+    if processed is not None:
+        return processed
+
+    max_edge = getattr(settings, 'IMAGE_MAX_EDGE', 1568)
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        output = io.BytesIO()
+        image.save(output, format='WEBP', quality=getattr(settings, 'IMAGE_QUALITY', 80), method=4)
+
+    processed = (output.getvalue(), 'image/webp')
+    PROCESSED_IMAGES.set(digest, processed, size=len(processed[0]))
+    return processed
+
+
+def process_image(data: bytes) -> Tuple[bytes, str]:
+    """
+    Downscale the image so its longest edge is at most IMAGE_MAX_EDGE pixels and re-encode it as WebP at
+    IMAGE_QUALITY. Metadata such as EXIF is not carried over to the result, after the orientation it records has been
+    applied to the pixels.
+    :return: The processed image and its mime type
+    """
+    return _process(io.BytesIO(data), hashlib.sha256(data).hexdigest())
+
+
+def process_uploaded_image(uploaded_file: UploadedFile) -> Tuple[bytes, str]:
+    """
+    Process an image uploaded in a multipart request the same way as process_image. The image is read from its
+    temporary file in chunks rather than being loaded into memory whole.
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return _process(uploaded_file, digest.hexdigest())
+
+
+def process_images(images: Sequence[Sequence[str]]) -> List[List[str]]:
+    """
+    Process each (base64 image, image mime, image name) item sent with a question. Items that cannot be read as an
+    image are returned unchanged.
+    """
+    logger = logging.getLogger('contact.images.process_images')
+    processed_images = []
+    for image in images or []:
+        data, mime, name = (list(image) + ['', ''])[:3]
+        try:
+            original = base64.b64decode(data)
+            processed, mime = process_image(original)
+        except (
+            binascii.Error,
+            TypeError,
+            ValueError,
+            UnidentifiedImageError,
+            OSError,
+            Image.DecompressionBombError,
+        ) as e:
+            logger.warning(f'Image {name} could not be processed and is sent as it is: {e}')
+            processed_images.append(list(image))
+            continue
+        logger.info(f'Image {name} processed from {len(original)} to {len(processed)} bytes')
+        processed_images.append([base64.b64encode(processed).decode('ascii'), mime, name])
+    return processed_images
+
+
+async def aprocess_images(images: Sequence[Sequence[str]]) -> List[List[str]]:
+    """
+    Run process_images in the image processing worker pool
+    """
+    if not images:
+        return []
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, process_images, images)
+
+
+def process_uploaded_images(uploaded_files: Sequence[UploadedFile]) -> List[List[str]]:
+    """
+    Process images uploaded in a multipart request into (base64 image, image mime, image name) items. Files that
+    cannot be read as an image are returned as they were uploaded.
+    """
+    logger = logging.getLogger('contact.images.process_uploaded_images')
+    images = []
+    for uploaded_file in uploaded_files:
+        try:
+            processed, mime = process_uploaded_image(uploaded_file)
+        except (ValueError, UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+            logger.warning(f'Image {uploaded_file.name} could not be processed and is sent as it is: {e}')
+            uploaded_file.seek(0)
+            processed, mime = uploaded_file.read(), uploaded_file.content_type
+        else:
+            logger.info(f'Image {uploaded_file.name} processed from {uploaded_file.size} to {len(processed)} bytes')
+        images.append([base64.b64encode(processed).decode('ascii'), mime, uploaded_file.name])
+        uploaded_file.close()
+    return images
+
+
+async def aprocess_uploaded_images(uploaded_files: Sequence[UploadedFile]) -> List[List[str]]:
+    """
+    Run process_uploaded_images in the image processing worker pool
+    """
+    if not uploaded_files:
+        return []
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, process_uploaded_images, uploaded_files)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Spool files uploaded in a multipart request to temporary files, never into memory, and skip any file larger than
+    IMAGE_UPLOAD_MAX_SIZE bytes as soon as that size is exceeded. The names of skipped files are kept in `oversized`.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_size = getattr(settings, 'IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+        self.oversized: List[str] = []
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.oversized.append(self.file_name)
+            raise SkipFile()
+        return super().receive_data_chunk(raw_data, start)
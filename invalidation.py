@@ -0,0 +1,225 @@
+# stdlib
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional
+# libs
+import psycopg
+from psycopg import sql
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+# local
+
+__all__ = [
+    'INVALIDATION_BUS',
+    'invalidation_stats',
+    'publish',
+    'register',
+]
+
+# Postgres limits the payload of a notification to 8000 bytes, keys are sent in as many notifications as needed
+MAX_PAYLOAD = 7900
+
+# OPTIONS of a Django database that are not libpq connection parameters
+DJANGO_OPTIONS = ('assume_role', 'isolation_level', 'pool', 'server_side_binding')
+
+
+class _Handler:
+    def __init__(self, evict: Callable[[str], object], reset: Optional[Callable[[], object]]):
+        self.evict = evict
+        self.reset = reset
+
+
+class InvalidationBus:
+    """
+    Evicts entries of the in-process caches in every worker when one worker changes the records they were built from.
+    Cache keys are strings of the form '<kind>:<value>', e.g. 'chatbot:12'. Each cache registers a handler for its
+    kinds, and `publish` evicts the keys in this worker and sends them with NOTIFY on the channel of the `contact`
+    database. A listener thread in each worker LISTENs on the channel and evicts the keys it receives, its own included,
+    as a NOTIFY sent in a transaction is only delivered once the transaction commits.
+    Notifications sent while the listener is disconnected are lost, so every registered cache is reset each time the
+    listener loses or regains its connection.
+    """
+
+    def __init__(self):
+        self.enabled = getattr(settings, 'CACHE_INVALIDATION_BUS', False)
+        self.alias = getattr(settings, 'CACHE_INVALIDATION_DATABASE', 'contact')
+        self.channel = getattr(settings, 'CACHE_INVALIDATION_CHANNEL', 'contact_cache_invalidation')
+        self.reconnect_delay = getattr(settings, 'CACHE_INVALIDATION_RECONNECT_DELAY', 1.0)
+        self.origin = f'{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._handlers: Dict[str, _Handler] = {}
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self.evicted = 0
+        self.resets = 0
+        self.errors = 0
+
+    def register(self, kind: str, evict: Callable[[str], object], reset: Optional[Callable[[], object]] = None):
+        """
+        Evict the value of each published '<kind>:<value>' key with evict, and clear the whole cache with reset when
+        notifications may have been missed
+        """
+        self._handlers[kind] = _Handler(evict, reset)
+
+    def evict(self, keys: Iterable[str]):
+        """
+        Evict the keys from the caches of this worker only
+        """
+        logger = logging.getLogger('contact.invalidation.evict')
+        for key in keys:
+            kind, _, value = key.partition(':')
+            handler = self._handlers.get(kind)
+            if handler is None:
+                continue
+            try:
+                handler.evict(value)
+                self.evicted += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f'Could not evict {key}: {e}')
+
+    def reset(self):
+        """
+        Clear every registered cache of this worker
+        """
+        for handler in self._handlers.values():
+            if handler.reset is not None:
+                handler.reset()
+        self.resets += 1
+
+    @staticmethod
+    def _payloads(origin: str, keys: List[str]) -> List[str]:
+        payloads = []
+        batch: List[str] = []
+        for key in keys:
+            payload = json.dumps({'origin': origin, 'keys': batch + [key]})
+            if len(batch) > 0 and len(payload.encode('utf-8')) > MAX_PAYLOAD:
+                payloads.append(json.dumps({'origin': origin, 'keys': batch}))
+                batch = []
+            batch.append(key)
+        if len(batch) > 0:
+            payloads.append(json.dumps({'origin': origin, 'keys': batch}))
+        return payloads
+
+    def publish(self, *keys: str):
+        """
+        Evict the keys in this worker and tell every other worker to evict them.
+        Called inside a transaction, the other workers are told when it commits.
+        """
+        keys = list(dict.fromkeys(key for key in keys if key))
+        if len(keys) == 0:
+            return
+        self.evict(keys)
+        if not self.enabled:
+            return
+        try:
+            with connections[self.alias].cursor() as cursor:
+                for payload in self._payloads(self.origin, keys):
+                    cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+            self.published += len(keys)
+        except Exception as e:
+            # The other workers will serve the stale entries until they expire
+            self.errors += 1
+            logging.getLogger('contact.invalidation.publish').error(
+                f'Could not publish the invalidation of {len(keys)} cache keys: {e}',
+            )
+
+    def _connect(self) -> psycopg.Connection:
+        database = settings.DATABASES[self.alias]
+        params = {
+            'dbname': database.get('NAME'),
+            'user': database.get('USER'),
+            'password': database.get('PASSWORD'),
+            'host': database.get('HOST'),
+            'port': database.get('PORT'),
+        }
+        params.update({
+            name: value for name, value in database.get('OPTIONS', {}).items() if name not in DJANGO_OPTIONS
+        })
+        params['application_name'] = f'contact_invalidation_{self.origin}'
+        return psycopg.connect(autocommit=True, **{name: value for name, value in params.items() if value})
+
+    def start(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='contact_invalidation', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        logger = logging.getLogger('contact.invalidation.listen')
+        while not self._stopping.is_set():
+            try:
+                with self._connect() as connection:
+                    connection.execute(sql.SQL('LISTEN {}').format(sql.Identifier(self.channel)))
+                    self.connected = True
+                    # Anything published before the LISTEN was missed
+                    self.reset()
+                    while not self._stopping.is_set():
+                        for notify in connection.notifies(timeout=1.0):
+                            self._receive(notify.payload)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f'Cache invalidation listener lost its connection, reconnecting: {e}')
+            finally:
+                if self.connected:
+                    self.connected = False
+                    self.reset()
+            self._stopping.wait(self.reconnect_delay)
+
+    def _receive(self, payload: str):
+        try:
+            keys = json.loads(payload)['keys']
+        except (ValueError, KeyError, TypeError):
+            logging.getLogger('contact.invalidation.receive').warning(f'Ignoring invalid notification {payload!r}')
+            return
+        self.received += len(keys)
+        self.evict(keys)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'enabled': self.enabled,
+            'connected': self.connected,
+            'published': self.published,
+            'received': self.received,
+            'evicted': self.evicted,
+            'resets': self.resets,
+            'errors': self.errors,
+        }
+
+
+INVALIDATION_BUS = InvalidationBus()
+
+
+def register(kind: str, evict: Callable[[str], object], reset: Optional[Callable[[], object]] = None):
+    INVALIDATION_BUS.register(kind, evict, reset)
+
+
+def publish(*keys: str):
+    INVALIDATION_BUS.publish(*keys)
+
+
+def invalidation_stats() -> Dict[str, object]:
+    return INVALIDATION_BUS.stats()
+
+
+def _start_listener(**kwargs):
+    # Only processes that serve requests listen, management commands never start the thread
+    INVALIDATION_BUS.start()
+
+
+request_started.connect(_start_listener, dispatch_uid='contact_invalidation_listener')
@@ -1,16 +1,22 @@
 # std lib
 import datetime
+import functools
+import hashlib
 import json
 import logging
 import string
+import time
 
 import openai
 # libs
 import httpx
 # local
 from django.conf import settings
-from contact.models import QAndA
-from openai import AsyncOpenAI
+from contact.cache import TTLCache
+from contact.clients import llm_client
+from contact.history import get_history
+from contact.invalidation import register
+from contact.tokens import count_tokens
 from pydantic import BaseModel
 
 
@@ -24,6 +30,46 @@ LLM_DICT = {
 }
 
 
+# Answers of Chatbots with cache_responses set, keyed by Chatbot and a hash of everything sent to the LLM.
+# Values are the answer text with the average size of the streamed chunks it arrived in.
+RESPONSE_CACHE = TTLCache(
+    'llm_response',
+    maxsize=getattr(settings, 'LLM_RESPONSE_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'LLM_RESPONSE_CACHE_TTL', 3600),
+    maxbytes=getattr(settings, 'LLM_RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+)
+
+
+def response_cache_key(chatbot, messages):
+    payload = json.dumps(
+        [messages, LLM_DICT[chatbot.nn_llm], chatbot.max_tokens, str(chatbot.temperature)],
+        sort_keys=True,
+        default=str,
+    )
+    return chatbot.pk, hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def invalidate_response_cache(chatbot_id):
+    """
+    Remove every cached answer of the Chatbot, i.e. after its prompts or LLM settings have changed
+    """
+    return RESPONSE_CACHE.delete_where(lambda key: key[0] == chatbot_id)
+
+
+register('response', lambda chatbot_id: invalidate_response_cache(int(chatbot_id)), RESPONSE_CACHE.clear)
+
+
+# Context window, in tokens, of the models in LLM_DICT
+LLM_CONTEXT_WINDOW = {
+    'UCCIX-Mistral-24B': 32768,
+    'Mistral-Large-3': 131072,
+}
+# Tokens counted for each image sent to the LLM
+IMAGE_TOKENS = 1000
+# Tokens the chat template of the LLM adds around each message
+MESSAGE_TOKENS = 4
+
+
 class TitleResponse(BaseModel):
     title: str
 
@@ -98,20 +144,18 @@ async def llm_summary(chatbot, messages):
     logger = logging.getLogger('contact.llm.llm_summary')
     logger.info('LLM Summary Process Start')
     try:
-        client = AsyncOpenAI(
-            api_key=chatbot.api_key,
-            base_url=settings.CLOUDCIX_LLM_URL,
-        )
-
-        chat_completion = await client.chat.completions.parse(
-            messages=messages,
-            model=LLM_DICT[chatbot.nn_llm],
-            timeout=600,
-            max_tokens=200,
-            temperature=0.15,
-            seed=42,
-            response_format=TitleResponse,
-        )
+        async with llm_client(chatbot.api_key, settings.CLOUDCIX_LLM_URL) as (client, reused):
+            start = time.perf_counter()
+
+            chat_completion = await client.chat.completions.parse(
+                messages=messages,
+                model=LLM_DICT[chatbot.nn_llm],
+                timeout=600,
+                max_tokens=200,
+                temperature=0.15,
+                seed=42,
+                response_format=TitleResponse,
+            )
     except (
         openai.APIConnectionError,
         openai.InternalServerError,
@@ -122,7 +166,7 @@ async def llm_summary(chatbot, messages):
     ) as e:  # pragma: no cover
         logger.error(f'A non 200 response has occurred with the LLM Summary service.\nException: {e}')
         raise ContactExceptionError()
-    logger.info('LLM Summary Process End')
+    logger.info(f'LLM Summary Process End ({time.perf_counter() - start:.3f}s, pooled client reused: {reused})')
 
     result = json.loads(chat_completion.choices[0].message.content)
     return result['title']
@@ -132,20 +176,18 @@ async def llm_rewrite_prompt(chatbot, messages, original_question=''):
     logger = logging.getLogger('contact.llm.llm_rewrite_prompt')
     logger.info('LLM Prompt Rewriting Process Start')
     try:
-        client = AsyncOpenAI(
-            api_key=chatbot.api_key,
-            base_url=settings.CLOUDCIX_LLM_URL,
-        )
-
-        chat_completion = await client.chat.completions.parse(
-            messages=messages,
-            model=LLM_DICT[chatbot.nn_llm],
-            timeout=600,
-            max_tokens=200,
-            temperature=0.1,
-            seed=42,
-            response_format=PromptRewriteResponse,
-        )
+        async with llm_client(chatbot.api_key, settings.CLOUDCIX_LLM_URL) as (client, reused):
+            start = time.perf_counter()
+
+            chat_completion = await client.chat.completions.parse(
+                messages=messages,
+                model=LLM_DICT[chatbot.nn_llm],
+                timeout=600,
+                max_tokens=200,
+                temperature=0.1,
+                seed=42,
+                response_format=PromptRewriteResponse,
+            )
     except (
         openai.APIConnectionError,
         openai.InternalServerError,
@@ -156,7 +198,9 @@ async def llm_rewrite_prompt(chatbot, messages, original_question=''):
     ) as e:  # pragma: no cover
         logger.error(f'A non 200 response has occurred with the LLM Prompt Rewriting service.\nException: {e}')
         raise ContactExceptionError()
-    logger.info('LLM Prompt Rewriting Process End')
+    logger.info(
+        f'LLM Prompt Rewriting Process End ({time.perf_counter() - start:.3f}s, pooled client reused: {reused})',
+    )
 
     result = json.loads(chat_completion.choices[0].message.content)
     rewritten_question = str(result.get('rewritten_question', '')).strip()
@@ -174,55 +218,73 @@ async def llm_rewrite_prompt(chatbot, messages, original_question=''):
 async def llm(chatbot, messages):
     logger = logging.getLogger('contact.llm.llm')
     logger.info('LLM Process Start')
-    try:
-        client = AsyncOpenAI(
-            api_key=chatbot.api_key,
-            base_url=settings.CLOUDCIX_LLM_URL,
+    cache_key = None
+    if getattr(chatbot, 'cache_responses', False):
+        cache_key = response_cache_key(chatbot, messages)
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info('LLM Process End (answer replayed from the response cache)')
+            text, chunk_size = cached
+            for i in range(0, len(text), chunk_size):
+                yield text[i:i + chunk_size]
+            return
+    # The client is held until the stream ends, so it cannot be closed while the answer is still being read from it
+    async with llm_client(chatbot.api_key, settings.CLOUDCIX_LLM_URL) as (client, reused):
+        try:
+            start = time.perf_counter()
+
+            chat_completion = await client.chat.completions.create(
+                messages=messages,
+                model=LLM_DICT[chatbot.nn_llm],
+                stream=True,
+                timeout=600,
+                max_tokens=chatbot.max_tokens,
+                temperature=float(chatbot.temperature),
+            )
+        except (
+            openai.APIConnectionError,
+            openai.InternalServerError,
+            httpx.ConnectError,
+            httpx.HTTPStatusError,
+            httpx.TimeoutException,
+            httpx.RequestError,
+        ) as e:  # pragma: no cover
+            logger.error(f'A non 200 response has occurred with the LLM service.\nException: {e}')
+            raise ContactExceptionError()
+        except openai.NotFoundError:
+            logger.error(
+                f'The requested model {LLM_DICT[chatbot.nn_llm]} was not found in the LLM service for Chatbot '
+                f'{chatbot.name}.',
+            )
+            error_message = (
+                'The LLM for this chatbot is deprecated. Please contact support.'
+            )
+            for chunk in error_message:
+                yield chunk
+            return
+
+        logger.info(
+            f'LLM Process End ({time.perf_counter() - start:.3f}s to response, pooled client reused: {reused})',
         )
 
-        chat_completion = await client.chat.completions.create(
-            messages=messages,
-            model=LLM_DICT[chatbot.nn_llm],
-            stream=True,
-            timeout=600,
-            max_tokens=chatbot.max_tokens,
-            temperature=float(chatbot.temperature),
-        )
-    except (
-        openai.APIConnectionError,
-        openai.InternalServerError,
-        httpx.ConnectError,
-        httpx.HTTPStatusError,
-        httpx.TimeoutException,
-        httpx.RequestError,
-    ) as e:  # pragma: no cover
-        logger.error(f'A non 200 response has occurred with the LLM service.\nException: {e}')
-        raise ContactExceptionError()
-    except openai.NotFoundError:
-        logger.error(
-            f'The requested model {LLM_DICT[chatbot.nn_llm]} was not found in the LLM service for Chatbot '
-            f'{chatbot.name}.',
-        )
-        error_message = (
-            'The LLM for this chatbot is deprecated. Please contact support.'
-        )
-        for chunk in error_message:
-            yield chunk
-        return
-
-    logger.info('LLM Process End')
-
-    async for chunk in chat_completion:
-        if not chunk.choices or chunk.choices[0].delta is None:
-            continue
-        content = chunk.choices[0].delta.content
-        if content == '<think>':
-            yield '[THINK]'
-        elif content == '</think>':
-            yield '[/THINK]'
-        else:
+        parts = []
+        async for chunk in chat_completion:
+            if not chunk.choices or chunk.choices[0].delta is None:
+                continue
+            content = chunk.choices[0].delta.content
+            if content == '<think>':
+                content = '[THINK]'
+            elif content == '</think>':
+                content = '[/THINK]'
+            if cache_key is not None and content:
+                parts.append(content)
             yield content
 
+    # Only answers that streamed to completion are cached
+    if cache_key is not None and len(parts) > 0:
+        text = ''.join(parts)
+        RESPONSE_CACHE.set(cache_key, (text, max(1, len(text) // len(parts))), size=len(text.encode('utf-8')))
+
 
 def echo(question):
     """
@@ -231,74 +293,28 @@ def echo(question):
     return str(question)
 
 
-def create_prompt(conversation, chatbot, similar_chunks, users_question, users_images):
-    logger = logging.getLogger('contact.llm.create_prompt')
-    logger.info('Prompt Construction Process Start')
-    prompt = []
-    # Building prompt for sent question
-    if bool(chatbot.system_prompt):
-        prompt = [{'role': 'system', 'content': chatbot.system_prompt}]
-
-    conversation_history = QAndA.objects.filter(
-        conversation=conversation).order_by('-created')
-    # Append previous answers to prompt constructed
-    for q_and_a in conversation_history:
-        if q_and_a.question_images and len(q_and_a.question_images) > 0:
-            prompt += [
-                {
-                    'role': 'user',
-                    'content': [
-                        {'type': 'text', 'text': q_and_a.question},
-                    ]
-                    + [
-                        {
-                            'type': 'image_url',
-                            'image_url': {
-                                'url': f'data:{image[1]};base64,{image[0]}',
-                                # https://platform.openai.com/docs/guides/images-vision?api-mode=chat&format=base64-encoded#analyze-images
-                            },
-                        }
-                        for image in q_and_a.question_images
-                    ],
-                },
-                {'role': 'assistant', 'content': q_and_a.answer},
-            ]
-        else:
-            prompt += [
-                {'role': 'user', 'content': q_and_a.question},
-                {'role': 'assistant', 'content': q_and_a.answer},
-            ]
-
-    if chatbot.nn_llm != 'deepseek':
-        content = f"""{users_question}"""
-        if bool(chatbot.user_prompt) and len(similar_chunks) > 0:
-            content += f"""\n\n{chatbot.user_prompt}"""
+def context_budget(chatbot) -> int:
+    """
+    The number of tokens the prompt sent to the Chatbot's LLM can use, i.e. the context window of the model less the
+    tokens reserved for the answer (max_tokens)
+    """
+    context_window = getattr(settings, 'LLM_CONTEXT_WINDOW', LLM_CONTEXT_WINDOW).get(LLM_DICT[chatbot.nn_llm], 32768)
+    return context_window - chatbot.max_tokens
 
-        count = 1
-        for chunk in similar_chunks:
-            content += f"""
 
-{count}. According to [Source {string.ascii_uppercase[count - 1]}]({chunk[0]}):
-{chunk[1]}"""
+def source_label(number: int) -> str:
+    """
+    The label of the source with the 1-based number: A to Z, then AA, AB and so on without limit
+    """
+    label = []
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        label.append(string.ascii_uppercase[remainder])
+    return ''.join(reversed(label))
 
-            count += 1
-    else:
-        content = ''
-        if len(similar_chunks) > 0:
-            if bool(chatbot.user_prompt):
-                content += f"""{chatbot.user_prompt}"""
-            content += "\n# The following contents are the search results related to the user's message:"
-            count = 1
-            for chunk in similar_chunks:
-                content += f"""
-[webpage {count} begin]
-webpage_url: {chunk[0]}
-webpage_content: {chunk[1]}
-[webpage {count} end]
-"""
-                count += 1
 
-            content += f"""
+DEEPSEEK_SEARCH_RESULTS_HEADER = "\n# The following contents are the search results related to the user's message:"
+DEEPSEEK_SEARCH_RESULTS_INSTRUCTIONS = """
 In the search results I provide to you, each result is formatted as [webpage X begin]...[webpage X end],
 where X represents the numerical index of each article. Please cite the context at the end of the relevant
 sentence when appropriate. Use the citation format [citation:X](citation_url) in the corresponding part of your answer.
@@ -306,7 +322,7 @@ If a sentence is derived from multiple contexts, list all relevant citation numb
 [citation:5](citation_url). Be sure not to cluster all citations at the end; instead, include them in the corresponding
 parts of the answer.
 When responding, please keep the following points in mind:
-- Today is {datetime.date.today()}.
+- Today is {today}.
 - Not all content in the search results is closely related to the user's question. You need to evaluate and filter the
 search results based on the question.
 - For listing-type questions (e.g., listing all flight information), try to limit the answer to 10 key points and inform
@@ -327,11 +343,198 @@ the same webpage.
 - Unless the user requests otherwise, your response should be in the same language as the user's question.
 
 # The user's message is:
-{users_question}
 """
+
+
+class PromptTemplate:
+    """
+    The template of the user message sent to a Chatbot's LLM, compiled once for each LLM format, user prompt and
+    layout. The constant parts are prepared up front and the message is assembled from its parts with a single join,
+    so building it costs time linear in the number of chunks.
+    With prefix_cache set, everything that does not change between questions comes first and the date, chunks and
+    question come last.
+    """
+
+    def __init__(self, deepseek: bool, user_prompt: str, prefix_cache: bool = False):
+        self.deepseek = deepseek
+        self.prefix_cache = prefix_cache
+        if deepseek and prefix_cache:
+            instructions = DEEPSEEK_SEARCH_RESULTS_INSTRUCTIONS.replace('- Today is {today}.\n', '').replace(
+                "\n# The user's message is:\n",
+                '',
+            )
+            self.chunks_prefix = [user_prompt, instructions] if user_prompt else [instructions]
+            self.chunks_prefix.append(DEEPSEEK_SEARCH_RESULTS_HEADER)
+        elif deepseek:
+            self.chunks_prefix = [user_prompt, DEEPSEEK_SEARCH_RESULTS_HEADER] if user_prompt else [
+                DEEPSEEK_SEARCH_RESULTS_HEADER,
+            ]
+            before_date, after_date = DEEPSEEK_SEARCH_RESULTS_INSTRUCTIONS.split('{today}')
+            self.instructions_before_date = before_date
+            self.instructions_after_date = after_date
+        elif prefix_cache:
+            self.chunks_prefix = [user_prompt] if user_prompt else []
         else:
-            content += f'{users_question}'
-    if users_images and len(users_images) > 0:
+            self.chunks_prefix = ['\n\n', user_prompt] if user_prompt else []
+
+    def chunk(self, number: int, chunk) -> str:
+        """
+        The text a retrieved (url, content) chunk adds to the user message, numbered by its rank
+        """
+        if self.deepseek:
+            return (
+                f'\n[webpage {number} begin]\nwebpage_url: {chunk[0]}\nwebpage_content: {chunk[1]}\n'
+                f'[webpage {number} end]\n'
+            )
+        return f'\n\n{number}. According to [Source {source_label(number)}]({chunk[0]}):\n{chunk[1]}'
+
+    def content(self, chunk_texts, users_question: str) -> str:
+        """
+        The user message for the question with the texts of the retrieved chunks sent with it
+        """
+        if len(chunk_texts) == 0:
+            return f'{users_question}'
+        if self.deepseek and self.prefix_cache:
+            parts = self.chunks_prefix + list(chunk_texts)
+            parts += [
+                f'\nToday is {datetime.date.today()}.\n\n# The user\'s message is:\n',
+                f'{users_question}',
+                '\n',
+            ]
+        elif self.deepseek:
+            parts = self.chunks_prefix + list(chunk_texts)
+            parts += [
+                self.instructions_before_date,
+                str(datetime.date.today()),
+                self.instructions_after_date,
+                f'{users_question}',
+                '\n',
+            ]
+        elif self.prefix_cache:
+            parts = self.chunks_prefix + list(chunk_texts) + ['\n\n', f'{users_question}']
+            return ''.join(parts).lstrip('\n')
+        else:
+            parts = [f'{users_question}'] + self.chunks_prefix + list(chunk_texts)
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_prompt_template(deepseek: bool, user_prompt: str, prefix_cache: bool) -> PromptTemplate:
+    return PromptTemplate(deepseek, user_prompt, prefix_cache)
+
+
+def prompt_template(chatbot) -> PromptTemplate:
+    """
+    The compiled PromptTemplate of the Chatbot. Templates are shared by Chatbots with the same LLM format, user prompt
+    and layout, and a change to any of them compiles a new one.
+    """
+    return _compile_prompt_template(
+        chatbot.nn_llm == 'deepseek',
+        chatbot.user_prompt or '',
+        chatbot.prefix_cache_layout,
+    )
+
+
+def create_prompt(conversation, chatbot, similar_chunks, users_question, users_images, span=None):
+    """
+    Build the messages sent to the Chatbot's LLM to answer the question, keeping them within context_budget.
+    The system prompt, the question and its images are always sent. When everything does not fit, images are dropped
+    from the oldest turns of the history first, then the oldest turns themselves, then the lowest ranked chunks.
+    With the prefix cache layout, history is sent oldest first and its oldest turns are dropped in blocks of
+    LLM_PREFIX_CACHE_HISTORY_BLOCK turns, both past the Chatbot's number of history turns and to fit the budget, so the
+    messages after the system prompt only change once every block of turns rather than on every turn.
+    The number of tokens of the prompt and what was dropped to fit it are tagged on span.
+    """
+    logger = logging.getLogger('contact.llm.create_prompt')
+    logger.info('Prompt Construction Process Start')
+    model = LLM_DICT[chatbot.nn_llm]
+    budget = context_budget(chatbot)
+    template = prompt_template(chatbot)
+    users_images = users_images or []
+
+    # Tokens of the sections that are always sent
+    system_tokens = 0
+    if bool(chatbot.system_prompt):
+        system_tokens = MESSAGE_TOKENS + count_tokens(chatbot.system_prompt, model)
+    question_tokens = MESSAGE_TOKENS + count_tokens(template.content([], users_question), model)
+    question_tokens += IMAGE_TOKENS * len(users_images)
+
+    # Chunks are in order of rank so the lowest ranked are dropped from the end
+    chunk_texts = [template.chunk(number, chunk) for number, chunk in enumerate(similar_chunks, start=1)]
+    chunk_tokens = [count_tokens(chunk_text, model) for chunk_text in chunk_texts]
+    chunks_overhead = 0
+    if len(chunk_texts) > 0:
+        # The user prompt and instructions that are only sent along with chunks
+        chunks_overhead = count_tokens(template.content(chunk_texts, users_question), model)
+        chunks_overhead -= question_tokens - MESSAGE_TOKENS - IMAGE_TOKENS * len(users_images) + sum(chunk_tokens)
+        chunks_overhead = max(chunks_overhead, 0)
+
+    # History is newest first so the oldest turns are dropped from the end
+    turns = chatbot.maximum_conversation_turn or getattr(settings, 'LLM_HISTORY_TURNS', 20)
+    block = 1
+    if chatbot.prefix_cache_layout:
+        block = max(min(getattr(settings, 'LLM_PREFIX_CACHE_HISTORY_BLOCK', 10), turns), 1)
+    history = [[turn, True] for turn in get_history(conversation, turns, block)]
+    history_tokens = sum(
+        2 * MESSAGE_TOKENS + turn.tokens(model) + IMAGE_TOKENS * len(turn.question_images) for turn, _ in history
+    )
+
+    def total():
+        chunks = chunks_overhead + sum(chunk_tokens) if len(chunk_tokens) > 0 else 0
+        return system_tokens + question_tokens + history_tokens + chunks
+
+    images_dropped = turns_dropped = chunks_dropped = 0
+    for item in reversed(history):
+        if total() <= budget:
+            break
+        if len(item[0].question_images) > 0:
+            history_tokens -= IMAGE_TOKENS * len(item[0].question_images)
+            images_dropped += len(item[0].question_images)
+            item[1] = False
+    while len(history) > 0 and total() > budget:
+        # The oldest turn left is at a multiple of block, dropping the turns up to the next one keeps it that way
+        for _ in range(min(block, len(history))):
+            turn, with_images = history.pop()
+            history_tokens -= 2 * MESSAGE_TOKENS + turn.tokens(model)
+            if with_images:
+                history_tokens -= IMAGE_TOKENS * len(turn.question_images)
+            turns_dropped += 1
+    while len(chunk_tokens) > 0 and total() > budget:
+        chunk_texts.pop()
+        chunk_tokens.pop()
+        chunks_dropped += 1
+
+    content = template.content(chunk_texts, users_question)
+    prompt_tokens = system_tokens + history_tokens + MESSAGE_TOKENS + count_tokens(content, model)
+    prompt_tokens += IMAGE_TOKENS * len(users_images)
+    if images_dropped or turns_dropped or chunks_dropped:
+        logger.info(
+            f'Prompt for Chatbot {chatbot.name} trimmed to {prompt_tokens} of {budget} tokens by dropping '
+            f'{images_dropped} history images, {turns_dropped} history turns and {chunks_dropped} chunks',
+        )
+    if prompt_tokens > budget:
+        logger.warning(
+            f'Prompt for Chatbot {chatbot.name} is {prompt_tokens} tokens, over its budget of {budget} tokens, with no '
+            'history or chunks left to drop',
+        )
+    if span is not None:
+        span.set_tag('prompt_tokens', prompt_tokens)
+        span.set_tag('prompt_budget', budget)
+        span.set_tag('prompt_history_images_dropped', images_dropped)
+        span.set_tag('prompt_history_turns_dropped', turns_dropped)
+        span.set_tag('prompt_chunks_dropped', chunks_dropped)
+
+    prompt = []
+    # Building prompt for sent question
+    if bool(chatbot.system_prompt):
+        prompt = [{'role': 'system', 'content': chatbot.system_prompt}]
+
+    # Append previous answers to prompt constructed. The prefix cache layout sends them oldest first so from one
+    # question to the next the messages before the new question stay the same
+    for turn, with_images in (reversed(history) if chatbot.prefix_cache_layout else history):
+        prompt += turn.messages(with_images)
+
+    if len(users_images) > 0:
         prompt += [
             {
                 'role': 'user',
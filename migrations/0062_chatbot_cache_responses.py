@@ -0,0 +1,17 @@
+# Generated manually
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contact', '0061_chatbot_maximum_conversation_turn'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbot',
+            name='cache_responses',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated manually
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contact', '0062_chatbot_cache_responses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbot',
+            name='semantic_cache_threshold',
+            field=models.DecimalField(
+                decimal_places=2,
+                default=0,
+                max_digits=3,
+                validators=[
+                    django.core.validators.MinValueValidator(0),
+                    django.core.validators.MaxValueValidator(1),
+                ],
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated manually
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contact', '0063_chatbot_semantic_cache_threshold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbot',
+            name='prefix_cache_layout',
+            field=models.BooleanField(default=False),
+        ),
+    ]
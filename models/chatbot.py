@@ -94,6 +94,7 @@ class Chatbot(BaseModel):
     button_background_colour = models.CharField(max_length=7, default='#47B2E4')
     button_text = models.CharField(max_length=50, default='Chatbot')
     button_text_colour = models.CharField(max_length=7, default='#FFFFFF')
+    cache_responses = models.BooleanField(default=False)
     chatbot_header_title = models.CharField(default='', max_length=255)
     chatbot_header_description = models.CharField(default='', max_length=255)
     chunk_size = models.IntegerField(default=1000)
@@ -123,6 +124,7 @@ class Chatbot(BaseModel):
     welcome_text = models.CharField(max_length=255, default='Please login to Chatbot')
     max_tokens = models.IntegerField(default=100)
     pdf_scraping = models.CharField(choices=PDF_SCRAPING_CHOICES, max_length=16, default=BASIC_SCRAPING)
+    prefix_cache_layout = models.BooleanField(default=False)
     temperature = models.DecimalField(
         max_digits=3,
         decimal_places=2,
@@ -137,6 +139,12 @@ class Chatbot(BaseModel):
     apply_reranking = models.BooleanField(default=False)
     reranking_limit = models.IntegerField(default=5)
     reranker = models.CharField(choices=RERANKER_CHOICES, max_length=20, default=MINILM_L_6_v2)
+    semantic_cache_threshold = models.DecimalField(
+        max_digits=3,
+        decimal_places=2,
+        default=0,
+        validators=[MinValueValidator(0), MaxValueValidator(1)],
+    )
     apply_intent_classification = models.BooleanField(default=False)
     apply_prompt_rewriting = models.BooleanField(default=False)
     rewrite_prompt = models.CharField(max_length=10000, null=True)
@@ -178,3 +186,6 @@ class Chatbot(BaseModel):
             conversation.cascade_delete()
         self.deleted = deltime
         self.save()
+        # Imported here as the Chatbot cache module imports the models
+        from contact.chatbot_cache import invalidate_chatbot
+        invalidate_chatbot(self)
@@ -5,6 +5,7 @@ from cloudcix_rest.models import BaseManager, BaseModel
 from django.db import models
 from django.urls import reverse
 # local
+from contact.invalidation import publish
 
 __all__ = [
     # Contact
@@ -112,3 +113,4 @@ class Contact(BaseModel):
         self.opportunities.clear()
         self.deleted = datetime.utcnow()
         self.save()
+        publish(f'contact:{self.pk}')
@@ -8,6 +8,7 @@ from django.urls import reverse
 from django.utils import timezone
 
 # local
+from contact.history import invalidate_history
 from .chatbot import Chatbot
 from .contact import Contact
 
@@ -62,3 +63,4 @@ class Conversation(BaseModel):
         self.questions.all().update(deleted=deltime)
         self.deleted = deltime
         self.save()
+        invalidate_history(self.pk)
@@ -38,7 +38,9 @@ class QAndA(BaseModel):
     conversation = models.ForeignKey(Conversation, on_delete=models.PROTECT, related_name='questions')
     question = models.TextField()
     intent = models.TextField(blank=True, null=True)
-    question_images = models.JSONField(default=list, blank=True)  # list of (base64 object, image mime, image name)
+    # list of (image reference, image mime, image name). Records created before images were moved to the blob store
+    # hold the base64 encoded image in place of the reference.
+    question_images = models.JSONField(default=list, blank=True)
 
     objects = QAndAManager()
 
@@ -0,0 +1,207 @@
+# stdlib
+import logging
+import math
+import re
+import threading
+import zlib
+from collections import Counter, deque
+from typing import Deque, Dict, FrozenSet, Optional, Tuple
+# libs
+from django.conf import settings
+# local
+from contact.cache import TTLCache
+from contact.invalidation import register
+from contact.models import Conversation, QAndA
+from contact.vector import normalise_query
+
+__all__ = [
+    'SEMANTIC_CACHE',
+    'content_tokens',
+    'cosine_similarity',
+    'key_tokens',
+    'question_vector',
+]
+
+# Questions are compared as hashed character trigram vectors, which is cheap enough to do on every first question and
+# needs no encoder round trip. Trigrams only find questions that are spelled nearly the same, they do not detect
+# paraphrases, and they score questions that differ in one name or number as nearly identical. A cached answer is
+# therefore only used when both questions have the same key tokens, and never below MIN_THRESHOLD.
+DIMENSIONS = 2 ** 20
+NGRAM = 3
+MIN_THRESHOLD = getattr(settings, 'SEMANTIC_CACHE_MIN_THRESHOLD', 0.9)
+
+WORD = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+NEGATIONS = frozenset(('no', 'not', 'never', 'nor', 'none', 'nothing', 'without', 'cannot'))
+# Capitalised words that start questions rather than name anything
+STOPWORDS = frozenset((
+    'a', 'am', 'an', 'and', 'any', 'are', 'at', 'be', 'by', 'can', 'could', 'did', 'do', 'does', 'for', 'from',
+    'good', 'have', 'hello', 'hey', 'hi', 'how', 'i', "i'd", "i'm", "i've", 'if', 'in', 'is', 'it', 'may', 'me', 'my',
+    'of', 'on', 'or', 'our', 'please', 'should', 'so', 'thanks', 'that', 'the', 'there', 'this', 'to', 'was', 'we',
+    'were', 'what', 'when', 'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your',
+))
+
+
+def question_vector(question: str) -> Dict[int, float]:
+    """
+    Build the L2 normalised sparse vector of hashed character n-grams of the question
+    """
+    text = f' {normalise_query(question)} '
+    counts = Counter(
+        zlib.crc32(text[i:i + NGRAM].encode('utf-8')) % DIMENSIONS for i in range(max(1, len(text) - NGRAM + 1))
+    )
+    norm = math.sqrt(sum(count * count for count in counts.values()))
+    return {dimension: count / norm for dimension, count in counts.items()}
+
+
+def content_tokens(question: str) -> FrozenSet[str]:
+    """
+    The lower cased words of the question that are not stopwords
+    """
+    return frozenset(word for word in WORD.findall(normalise_query(question)) if word not in STOPWORDS)
+
+
+def key_tokens(question: str) -> FrozenSet[str]:
+    """
+    The tokens of the question that change what the right answer is however similar the rest of it is: numbers,
+    capitalised words such as names and places, and negations
+    """
+    tokens = set()
+    for word in WORD.findall(str(question)):
+        lower = word.lower()
+        if any(character.isdigit() for character in word):
+            tokens.add(lower)
+        elif lower in NEGATIONS or lower.endswith("n't"):
+            tokens.add('not')
+        elif word[0].isupper() and lower not in STOPWORDS:
+            tokens.add(lower)
+    return frozenset(tokens)
+
+
+def cosine_similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(dimension, 0.0) for dimension, value in a.items())
+
+
+class SemanticIndex:
+    """
+    The most recently answered first questions of one Chatbot with their answers
+    """
+
+    def __init__(self, maxsize: int):
+        self.entries: Deque[Tuple[FrozenSet[str], Dict[int, float], str]] = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+
+    def add(self, question: str, answer: str):
+        entry = (key_tokens(question), question_vector(question), answer)
+        with self._lock:
+            self.entries.append(entry)
+
+    def best_match(self, question: str) -> Tuple[float, Optional[str]]:
+        """
+        The most similar question with the same key tokens as the question, and its answer
+        """
+        keys = key_tokens(question)
+        vector = question_vector(question)
+        best_score, best_answer = 0.0, None
+        with self._lock:
+            entries = list(self.entries)
+        # Newest entries are checked first so on a tie the most recent answer wins
+        for entry_keys, entry_vector, answer in reversed(entries):
+            if entry_keys != keys:
+                continue
+            score = cosine_similarity(vector, entry_vector)
+            if score > best_score:
+                best_score, best_answer = score, answer
+        return best_score, best_answer
+
+
+class SemanticCache:
+    """
+    Per Chatbot cache of answers to first questions in a Conversation, looked up by the spelling similarity of questions
+    that mention the same names, numbers and negations.
+    Indexes are loaded from the QAndA records of the Chatbot's latest Conversations on first use and extended as new
+    first questions are answered. Only answers given since the Chatbot was last changed are loaded, as older ones were
+    given with other prompts or corpora.
+    """
+
+    def __init__(self):
+        self.maxsize = getattr(settings, 'SEMANTIC_CACHE_SIZE', 1000)
+        self.indexes = TTLCache(
+            'semantic_answers',
+            maxsize=getattr(settings, 'SEMANTIC_CACHE_CHATBOTS', 512),
+            ttl=getattr(settings, 'SEMANTIC_CACHE_TTL', 3600),
+        )
+        self.lookups = 0
+        self.hits = 0
+        self.seconds_saved = 0.0
+        # Moving average of how long answering a first question takes when it is not served from this cache
+        self.answer_seconds = 0.0
+
+    def _load(self, chatbot) -> SemanticIndex:
+        index = SemanticIndex(self.maxsize)
+        latest_conversations = Conversation.objects.filter(
+            chatbot_id=chatbot.pk,
+        ).order_by('-created').values('id')[:self.maxsize]
+        first_questions = QAndA.objects.filter(
+            conversation_id__in=latest_conversations,
+        ).prefetch_related(None).order_by(
+            'conversation_id',
+            'created',
+        ).distinct(
+            'conversation_id',
+        ).values_list('question', 'answer', 'question_images', 'created')
+        for question, answer, question_images, created in first_questions:
+            # The first question of the Conversation is only used if it was answered since the Chatbot last changed
+            if not question_images and answer and created >= chatbot.updated:
+                index.add(question, answer)
+        return index
+
+    def index(self, chatbot) -> SemanticIndex:
+        """
+        Get the index of the Chatbot, loading it from the database when it is not cached. Runs database queries.
+        """
+        index = self.indexes.get(chatbot.pk)
+        if index is None:
+            index = self._load(chatbot)
+            self.indexes.set(chatbot.pk, index)
+        return index
+
+    def lookup(self, chatbot, question: str) -> Optional[str]:
+        """
+        Return the cached answer of the most similar first question, if it is similar enough for the Chatbot and at
+        least MIN_THRESHOLD
+        """
+        logger = logging.getLogger('contact.semantic_cache.lookup')
+        self.lookups += 1
+        score, answer = self.index(chatbot).best_match(question)
+        if answer is None or score < max(float(chatbot.semantic_cache_threshold), MIN_THRESHOLD):
+            return None
+        self.hits += 1
+        self.seconds_saved += self.answer_seconds
+        logger.info(f'Semantic cache hit for Chatbot {chatbot.name} with a similarity of {score:.3f}')
+        return answer
+
+    def add(self, chatbot_id: int, question: str, answer: str, seconds: float):
+        """
+        Store the answer to a first question that was answered without this cache, and how long that took
+        """
+        self.answer_seconds = seconds if self.answer_seconds == 0 else 0.9 * self.answer_seconds + 0.1 * seconds
+        index = self.indexes.get(chatbot_id)
+        if index is not None:
+            index.add(question, answer)
+
+    def invalidate(self, chatbot_id: int):
+        self.indexes.delete(chatbot_id)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            'seconds_saved': round(self.seconds_saved, 3),
+        }
+
+
+SEMANTIC_CACHE = SemanticCache()
+register('semantic', lambda chatbot_id: SEMANTIC_CACHE.invalidate(int(chatbot_id)), SEMANTIC_CACHE.indexes.clear)
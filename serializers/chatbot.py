@@ -45,6 +45,10 @@ class ChatbotSerializer(serpy.Serializer):
             The hex code for the colour of the text on the button embded on your website to launch the iframe for the
             Chatbot.
         type: string
+    cache_responses:
+        description: |
+            If True, answers generated by the LLM are cached and replayed when the exact same prompt is sent again.
+        type: boolean
     chatbot_header_title:
         description: |
             The title displayed in the header of the Chatbot interface.
@@ -120,6 +124,13 @@ class ChatbotSerializer(serpy.Serializer):
     pdf_scraping:
         description: The Scraping method for PDF documents
         type: string
+    prefix_cache_layout:
+        description: |
+            If True, the prompt sent to the LLM is laid out to keep its start the same from turn to turn, so the LLM
+            service can reuse its cache of a previous prompt. Once a Conversation has more turns than are sent as
+            history, its oldest turns are dropped in blocks, so the start of the prompt only changes once per block of
+            turns rather than on every turn.
+        type: boolean
     reference_limit:
         description: Number of references between 1-50
         type: int
@@ -134,6 +145,13 @@ class ChatbotSerializer(serpy.Serializer):
     reranking_limit:
         description: Number of references between 1-50
         type: int
+    semantic_cache_threshold:
+        description: |
+            The spelling similarity, between 0 and 1, a first question in a Conversation must have with a previously
+            answered first question that mentions the same names, numbers and negations for the previous answer to be
+            returned. Similarities below 0.9 are never used. A value of 0 disables the semantic cache.
+        type: string
+        format: decimal
     similarity:
         description: The Vector Similarity formula for retrieval of Embeddings for Chatbot instance.
         type: string
@@ -197,6 +215,7 @@ class ChatbotSerializer(serpy.Serializer):
     vertical_position = serpy.Field()
     button_text = serpy.Field()
     button_text_colour = serpy.Field()
+    cache_responses = serpy.Field()
     chunk_overlap = serpy.Field()
     chunk_size = serpy.Field()
     chatbot_header_title = serpy.Field()
@@ -217,10 +236,12 @@ class ChatbotSerializer(serpy.Serializer):
     nn_llm = serpy.Field()
     nn_embedding = serpy.Field()
     pdf_scraping = serpy.Field()
+    prefix_cache_layout = serpy.Field()
     reference_limit = serpy.Field()
     no_reference_answer = serpy.Field()
     reranker = serpy.Field()
     reranking_limit = serpy.Field()
+    semantic_cache_threshold = serpy.Field()
     similarity = serpy.Field()
     system_prompt = serpy.Field()
     smalltalk_prompt = serpy.Field()
@@ -27,10 +27,12 @@ class QAndASerializer(serpy.Serializer):
         description: The question the contact asked the chatbot.
         type: string
     question_images:
-        description: List of (base64 encoded image object, image mime, image name) sent by the user.
+        description: |
+            List of (image, image mime, image name) sent by the user. The image is the base64 encoded image, or when
+            a blob store is configured for the service, "sha256:" followed by the SHA-256 digest of the image in it.
         type: array
         items:
-            description: A tuple containing (base64 encoded image object, image mime, image name).
+            description: A tuple containing (image reference, image mime, image name).
             type: array
             items:
                 type: string
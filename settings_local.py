@@ -17,6 +17,23 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
+# Connection pools of the psycopg backend, shared by the threads of each worker. With CONN_HEALTH_CHECKS set on a
+# database, Django checks each connection before the pool hands it out, and connections are replaced once idle for
+# DB_POOL_MAX_IDLE or older than DB_POOL_MAX_LIFETIME seconds.
+# DB_POOL_MAX_SIZE should cover the requests a worker serves at once plus the write behind thread, and the pool sizes of
+# every worker together must stay under the max_connections of the server. Pooling needs Django 5.1 or later.
+DB_POOL = os.getenv('DB_POOL', 'true').lower() == 'true'
+DB_POOL_OPTIONS = {
+    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '16')),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+    'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+}
+# Only Django's own tables are in the default database, so its pool is kept small
+DB_POOL_DEFAULT_OPTIONS = {**DB_POOL_OPTIONS, 'max_size': int(os.getenv('DB_POOL_DEFAULT_MAX_SIZE', '4'))}
+DB_HEALTH_CHECKS = os.getenv('DB_HEALTH_CHECKS', 'true').lower() == 'true'
+
 DATABASES = {
     'contact': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -25,6 +42,8 @@ DATABASES = {
         'PASSWORD': PGSQLAPI_PASSWORD,
         'HOST': PGSQLAPI_HOST,
         'PORT': '5432',
+        'OPTIONS': {'pool': DB_POOL_OPTIONS} if DB_POOL else {},
+        'CONN_HEALTH_CHECKS': DB_HEALTH_CHECKS,
     },
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -33,9 +52,32 @@ DATABASES = {
         'PASSWORD': PGSQLAPI_PASSWORD,
         'HOST': PGSQLAPI_HOST,
         'PORT': '5432',
+        'OPTIONS': {'pool': DB_POOL_DEFAULT_OPTIONS} if DB_POOL else {},
+        'CONN_HEALTH_CHECKS': DB_HEALTH_CHECKS,
     },
 }
 
+# Read replica of the contact database used by the list endpoints. Locally it is a second database on the same server
+CONTACT_REPLICA = os.getenv('CONTACT_REPLICA', 'false').lower() == 'true'
+if CONTACT_REPLICA:
+    DATABASES['contact_replica'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('CONTACT_REPLICA_NAME', 'contact_replica'),
+        'USER': os.getenv('CONTACT_REPLICA_USER', PGSQLAPI_USER),
+        'PASSWORD': os.getenv('CONTACT_REPLICA_PASSWORD', PGSQLAPI_PASSWORD),
+        'HOST': os.getenv('CONTACT_REPLICA_HOST', PGSQLAPI_HOST),
+        'PORT': os.getenv('CONTACT_REPLICA_PORT', '5432'),
+        'OPTIONS': {'pool': DB_POOL_OPTIONS} if DB_POOL else {},
+        'CONN_HEALTH_CHECKS': DB_HEALTH_CHECKS,
+        'TEST': {'MIRROR': 'contact'},
+    }
+# Seconds after a client writes during which its reads stay on the primary, see ReplicaClientMiddleware. The window is
+# kept by the client in a signed cookie, so it holds whichever worker serves its requests
+CONTACT_REPLICA_STICKY_SECONDS = float(os.getenv('CONTACT_REPLICA_STICKY_SECONDS', '5'))
+# Reads go to the primary while the replica lags by more than this many seconds, checked every interval
+CONTACT_REPLICA_MAX_LAG = float(os.getenv('CONTACT_REPLICA_MAX_LAG', '2'))
+CONTACT_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('CONTACT_REPLICA_LAG_CHECK_INTERVAL', '5'))
+
 DATABASE_ROUTERS = [
     'contact.db_router.ContactRouter',
 ]
@@ -60,3 +102,100 @@ CHATBOT_URL = os.getenv('CHATBOT_URL')
 CLOUDCIX_ML_URL = os.getenv('CLOUDCIX_ML_URL')
 EMBEDDING_DB_URL = os.getenv('EMBEDDING_DB_URL', f'{CLOUDCIX_ML_URL}/embedding/')
 CLOUDCIX_LLM_URL = os.getenv('CLOUDCIX_LLM_URL', 'https://inference.cloudcix.com')
+
+# Embedding DB async client (connection pooling)
+EMBEDDING_DB_HTTP2 = os.getenv('EMBEDDING_DB_HTTP2', 'true').lower() == 'true'
+EMBEDDING_DB_MAX_CONNECTIONS = int(os.getenv('EMBEDDING_DB_MAX_CONNECTIONS', '100'))
+EMBEDDING_DB_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('EMBEDDING_DB_MAX_KEEPALIVE_CONNECTIONS', '20'))
+EMBEDDING_DB_KEEPALIVE_EXPIRY = float(os.getenv('EMBEDDING_DB_KEEPALIVE_EXPIRY', '30'))
+
+# LLM client registry (connection pooling)
+LLM_CLIENT_POOL_SIZE = int(os.getenv('LLM_CLIENT_POOL_SIZE', '32'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'true').lower() == 'true'
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '100'))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '20'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))
+
+# Cache of Corpus source URLs used by the answer hallucination check
+CORPUS_URL_CACHE_SIZE = int(os.getenv('CORPUS_URL_CACHE_SIZE', '1024'))
+CORPUS_URL_CACHE_TTL = float(os.getenv('CORPUS_URL_CACHE_TTL', '300'))
+CORPUS_URL_CACHE_STALE_TTL = float(os.getenv('CORPUS_URL_CACHE_STALE_TTL', '3600'))
+
+# Cache of retrieved chunks for repeated questions
+RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '4096'))
+RETRIEVAL_CACHE_TTL = float(os.getenv('RETRIEVAL_CACHE_TTL', '600'))
+
+# Cache of LLM answers for Chatbots with cache_responses set
+LLM_RESPONSE_CACHE_SIZE = int(os.getenv('LLM_RESPONSE_CACHE_SIZE', '10000'))
+LLM_RESPONSE_CACHE_TTL = float(os.getenv('LLM_RESPONSE_CACHE_TTL', '3600'))
+LLM_RESPONSE_CACHE_MAX_BYTES = int(os.getenv('LLM_RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Semantic cache of answers to first questions, for Chatbots with a semantic_cache_threshold
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '1000'))
+SEMANTIC_CACHE_CHATBOTS = int(os.getenv('SEMANTIC_CACHE_CHATBOTS', '512'))
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', '3600'))
+# Lowest similarity at which a cached answer is used, whatever the semantic_cache_threshold of the Chatbot
+SEMANTIC_CACHE_MIN_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_MIN_THRESHOLD', '0.9'))
+
+# Number of previous turns of a Conversation sent to the LLM when the Chatbot has no maximum_conversation_turn
+LLM_HISTORY_TURNS = int(os.getenv('LLM_HISTORY_TURNS', '20'))
+# With the prefix cache layout, the oldest turns of history are dropped this many at a time, so the start of the prompt
+# stays the same for this many turns in a row once a Conversation is longer than its history
+LLM_PREFIX_CACHE_HISTORY_BLOCK = int(os.getenv('LLM_PREFIX_CACHE_HISTORY_BLOCK', '10'))
+
+# Paths of the tokenizer.json files used to count prompt tokens per model, token counts are estimated when not set
+LLM_TOKENIZERS = {
+    'UCCIX-Mistral-24B': os.getenv('LLM_TOKENIZER_UCCIX_MISTRAL_24B', ''),
+    'Mistral-Large-3': os.getenv('LLM_TOKENIZER_MISTRAL_LARGE_3', ''),
+}
+
+# In-process cache of Conversation history used to build prompts
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', '10000'))
+HISTORY_CACHE_IDLE_TTL = float(os.getenv('HISTORY_CACHE_IDLE_TTL', '1800'))
+HISTORY_CACHE_TURNS = int(os.getenv('HISTORY_CACHE_TURNS', '50'))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv('HISTORY_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Content addressed storage of images sent with questions. Only used when CONTACT_BLOB_STORE_ROOT is set, and it must
+# be storage shared by every pod, e.g. a network filesystem. Images are kept inline in QAndA records otherwise
+CONTACT_BLOB_STORE = os.getenv('CONTACT_BLOB_STORE', 'contact.blobstore.FileSystemBlobStore')
+CONTACT_BLOB_STORE_ROOT = os.getenv('CONTACT_BLOB_STORE_ROOT', '')
+
+# Processing of images sent with questions before they are sent to the LLM
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '1568'))
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '80'))
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', '4'))
+IMAGE_CACHE_SIZE = int(os.getenv('IMAGE_CACHE_SIZE', '1024'))
+IMAGE_CACHE_TTL = float(os.getenv('IMAGE_CACHE_TTL', '3600'))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', str(10 * 1024 * 1024)))
+
+# Grouping of streamed answer deltas into response frames
+ANSWER_FRAME_MAX_SIZE = int(os.getenv('ANSWER_FRAME_MAX_SIZE', '512'))
+ANSWER_FRAME_MAX_DELAY = float(os.getenv('ANSWER_FRAME_MAX_DELAY', '0.05'))
+ANSWER_FRAME_FIRST_IMMEDIATE = os.getenv('ANSWER_FRAME_FIRST_IMMEDIATE', 'true').lower() == 'true'
+
+# Write behind saving of QAndA records and Conversation last_message_at after an answer has been streamed
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'true').lower() == 'true'
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', '10000'))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '100'))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.2'))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', '5'))
+WRITE_BEHIND_RETRY_DELAY = float(os.getenv('WRITE_BEHIND_RETRY_DELAY', '0.5'))
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv('WRITE_BEHIND_SHUTDOWN_TIMEOUT', '30'))
+
+# Start the safety, intent and rewrite LLM calls of a question together instead of one after the other
+ANSWER_SPECULATIVE_PREPROCESSING = os.getenv('ANSWER_SPECULATIVE_PREPROCESSING', 'false').lower() == 'true'
+
+# Retrieve chunks for the original question while it is rewritten, used when the rewrite adds no words to it
+ANSWER_SPECULATIVE_RETRIEVAL = os.getenv('ANSWER_SPECULATIVE_RETRIEVAL', 'true').lower() == 'true'
+
+# Eviction of in-process cache entries in every worker, with NOTIFY on a channel of the contact database
+CACHE_INVALIDATION_BUS = os.getenv('CACHE_INVALIDATION_BUS', 'true').lower() == 'true'
+CACHE_INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'contact_cache_invalidation')
+CACHE_INVALIDATION_RECONNECT_DELAY = float(os.getenv('CACHE_INVALIDATION_RECONNECT_DELAY', '1'))
+
+# Per worker cache of Chatbot records. Records are revalidated against their updated timestamp after the TTL, which
+# can be long while the invalidation bus evicts changed records
+CHATBOT_CACHE_SIZE = int(os.getenv('CHATBOT_CACHE_SIZE', '1024'))
+CHATBOT_CACHE_TTL = float(os.getenv('CHATBOT_CACHE_TTL', '600' if CACHE_INVALIDATION_BUS else '30'))
+CHATBOT_CACHE_STALE_TTL = float(os.getenv('CHATBOT_CACHE_STALE_TTL', '3600'))
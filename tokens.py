@@ -0,0 +1,52 @@
+# stdlib
+import functools
+import logging
+from typing import Optional
+# libs
+from django.conf import settings
+from tokenizers import Tokenizer
+# local
+
+__all__ = [
+    'count_tokens',
+    'estimate_tokens',
+]
+
+
+def estimate_tokens(text) -> int:
+    """
+    Rough count of the tokens in text, at about 4 characters per token
+    """
+    if not text:
+        return 0
+    return len(str(text)) // 4 + 1
+
+
+@functools.lru_cache(maxsize=None)
+def _tokenizer(model: str) -> Optional[Tokenizer]:
+    """
+    Load the tokenizer of the model from the tokenizer.json file configured for it in LLM_TOKENIZERS, if any
+    """
+    path = getattr(settings, 'LLM_TOKENIZERS', {}).get(model)
+    if not path:
+        return None
+    try:
+        return Tokenizer.from_file(path)
+    except Exception as e:
+        logging.getLogger('contact.tokens._tokenizer').error(
+            f'Could not load the tokenizer of {model} from {path}, token counts will be estimated: {e}',
+        )
+        return None
+
+
+def count_tokens(text, model: Optional[str] = None) -> int:
+    """
+    Count the tokens in text with the tokenizer of the model, falling back to estimate_tokens when no tokenizer is
+    configured for it
+    """
+    if not text:
+        return 0
+    tokenizer = _tokenizer(model) if model else None
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(str(text), add_special_tokens=False).ids)
@@ -1,5 +1,8 @@
-from django.http import StreamingHttpResponse
+# stdlib
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Union
 # libs
+from django.http import StreamingHttpResponse
 # local
 
 
@@ -14,3 +17,76 @@ class CustomStreamingHttpResponse(StreamingHttpResponse):
 
         self['Cache-Control'] = 'no-cache'
         self['X-Accel-Buffering'] = 'no'
+
+
+async def coalesce_frames(
+    stream: AsyncIterable[Union[str, bytes]],
+    max_size: int,
+    max_delay: float,
+    first_frame_immediate: bool = True,
+) -> AsyncIterator[Union[str, bytes]]:
+    """
+    Group the str or bytes items of an async stream into larger frames. A frame is sent once it holds max_size
+    characters or bytes, or max_delay seconds after its first item arrived, whichever comes first. With
+    first_frame_immediate the first item is sent on its own as soon as it arrives, so the time to first token is not
+    delayed. Empty items are dropped.
+    If the stream raises, what has been buffered is sent before the exception is re-raised.
+    """
+    if max_size <= 1 or max_delay <= 0:
+        async for item in stream:
+            if item:
+                yield item
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    buffer = []
+    size = 0
+    deadline = None
+    pending = None
+    first = first_frame_immediate
+    try:
+        while True:
+            try:
+                if pending is None and deadline is None:
+                    # Nothing is buffered so there is no window to close, just wait for the next item
+                    item = await iterator.__anext__()
+                else:
+                    if pending is None:
+                        pending = asyncio.ensure_future(iterator.__anext__())
+                    timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                    done, _ = await asyncio.wait((pending,), timeout=timeout)
+                    if len(done) == 0:
+                        # The window closed before the next item arrived, send what has been buffered
+                        yield buffer[0][:0].join(buffer)
+                        buffer, size, deadline = [], 0, None
+                        continue
+                    task, pending = pending, None
+                    item = task.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                if len(buffer) > 0:
+                    yield buffer[0][:0].join(buffer)
+                    buffer = []
+                raise
+
+            if not item:
+                continue
+            if first:
+                first = False
+                yield item
+                continue
+            buffer.append(item)
+            size += len(item)
+            if deadline is None:
+                deadline = loop.time() + max_delay
+            if size >= max_size:
+                yield buffer[0][:0].join(buffer)
+                buffer, size, deadline = [], 0, None
+
+        if len(buffer) > 0:
+            yield buffer[0][:0].join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
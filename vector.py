@@ -1,20 +1,27 @@
 # stdlib
-from typing import List
+import asyncio
+import time
+from typing import Awaitable, Dict, Iterable, List, Tuple
 import logging
 import requests
 # libs
 from django.conf import settings
 # local
+from contact.cache import TTLCache
+from contact.clients import get_embedding_db_client
+from contact.invalidation import register
 
+# Final top chunks of the retrieval stage. Entries are keyed on the corpora and retrieval settings rather than the
+# Chatbot so Chatbots that share corpora share entries too.
+RETRIEVAL_CACHE = TTLCache(
+    'retrieval',
+    maxsize=getattr(settings, 'RETRIEVAL_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'RETRIEVAL_CACHE_TTL', 600),
+)
 
-def vector_similarity(api_key, names, encoder, query, order_by, limit, threshold):  # pragma: no cover
-    logger = logging.getLogger('contact.vector.vector_similarity')
-    if settings.TESTING:
-        return []
 
-    logger.info(f'Vector DB Embeddings retrieval Process with Model {encoder} Start')
-    embedding_vectors = []
-    data = {
+def _vector_search_data(names, encoder, query, order_by, limit, threshold) -> Dict:
+    return {
         'names': names,
         'method': 'vector_search',
         'encoder_name': encoder,
@@ -23,6 +30,38 @@ def vector_similarity(api_key, names, encoder, query, order_by, limit, threshold
         'threshold': threshold,
         'limit': limit,
     }
+
+
+def _keyword_search_data(names, chunks, limit, query) -> Dict:
+    return {
+        'method': 'keyword_search',
+        'names': names,
+        'chunks': chunks,
+        'limit': limit,
+        'query': query,
+    }
+
+
+def _rerank_data(chatbot, chunks: List, users_question: str) -> Dict:
+    return {
+        'method': 'rerank',
+        'reranker': chatbot.reranker,
+        'reranking_limit': chatbot.reranking_limit,
+        'query': users_question,
+        'chunks': chunks,
+    }
+
+
+def _content(response) -> List:
+    if response.status_code == 200:
+        return response.json()['content']
+    return []
+
+
+def _post(logger, api_key, data: Dict) -> List:  # pragma: no cover
+    """
+    Send the request to the Embedding DB API, returning the content of its response or [] if it failed
+    """
     try:
         response = requests.post(
             url=settings.EMBEDDING_DB_URL,
@@ -30,13 +69,54 @@ def vector_similarity(api_key, names, encoder, query, order_by, limit, threshold
             headers={'Authorization': f'Bearer {api_key}'},
             timeout=600,
         )
-    except Exception as e:  # pragma: no cover
+    except Exception as e:
         logger.error(f'A non 200 response has occurred with the Embedding DB API service: {e}.')
         return []
+    return _content(response)
+
+
+async def _apost(logger, api_key, data: Dict) -> List:  # pragma: no cover
+    """
+    Non-blocking version of _post, using the shared Embedding DB client of the running event loop
+    """
+    try:
+        response = await get_embedding_db_client().post(
+            url=settings.EMBEDDING_DB_URL,
+            json=data,
+            headers={'Authorization': f'Bearer {api_key}'},
+        )
+    except Exception as e:
+        logger.error(f'A non 200 response has occurred with the Embedding DB API service: {e}.')
+        return []
+    return _content(response)
 
-    if response.status_code == 200:
-        embedding_vectors.extend(response.json()['content'])
 
+def vector_similarity(api_key, names, encoder, query, order_by, limit, threshold):  # pragma: no cover
+    logger = logging.getLogger('contact.vector.vector_similarity')
+    if settings.TESTING:
+        return []
+
+    logger.info(f'Vector DB Embeddings retrieval Process with Model {encoder} Start')
+    embedding_vectors = _post(logger, api_key, _vector_search_data(names, encoder, query, order_by, limit, threshold))
+    logger.info(f'Vector DB Embeddings retrieval Process with Model {encoder} End')
+
+    return embedding_vectors
+
+
+async def async_vector_similarity(api_key, names, encoder, query, order_by, limit, threshold):  # pragma: no cover
+    """
+    Non-blocking version of vector_similarity
+    """
+    logger = logging.getLogger('contact.vector.async_vector_similarity')
+    if settings.TESTING:
+        return []
+
+    logger.info(f'Vector DB Embeddings retrieval Process with Model {encoder} Start')
+    embedding_vectors = await _apost(
+        logger,
+        api_key,
+        _vector_search_data(names, encoder, query, order_by, limit, threshold),
+    )
     logger.info(f'Vector DB Embeddings retrieval Process with Model {encoder} End')
 
     return embedding_vectors
@@ -47,58 +127,152 @@ def best_match_25(api_key, names, chunks, limit, query):  # pragma: no cover
         return []
 
     logger = logging.getLogger('contact.vector.best_match_25')
-    top_chunks = []
-    try:
-        data = {
-            'method': 'keyword_search',
-            'names': names,
-            'chunks': chunks,
-            'limit': limit,
-            'query': query,
-        }
-        response = requests.post(
-            url=settings.EMBEDDING_DB_URL,
-            json=data,
-            headers={'Authorization': f'Bearer {api_key}'},
-            timeout=600,
-        )
-    except Exception as e:
-        logger.error(f'A non 200 response has occurred with the Embedding DB API service: {e}.')
-        return top_chunks
+    top_chunks = _post(logger, api_key, _keyword_search_data(names, chunks, limit, query))
+    logger.info('Key word search End')
 
-    if response.status_code == 200:
-        top_chunks = response.json()['content']
+    return top_chunks
+
+
+async def async_best_match_25(api_key, names, chunks, limit, query):  # pragma: no cover
+    """
+    Non-blocking version of best_match_25
+    """
+    if settings.TESTING:
+        return []
 
+    logger = logging.getLogger('contact.vector.async_best_match_25')
+    top_chunks = await _apost(logger, api_key, _keyword_search_data(names, chunks, limit, query))
     logger.info('Key word search End')
 
     return top_chunks
 
 
-def rerank(chatbot, chunks: List, users_question: str):
-    logger = logging.getLogger('contact.vector.rerank')
+async def async_rerank(chatbot, chunks: List, users_question: str):
+    logger = logging.getLogger('contact.vector.async_rerank')
     logger.info('Rerank Process Start')
-    reranked_chunks = []
-    try:
-        data = {
-            'method': 'rerank',
-            'reranker': chatbot.reranker,
-            'reranking_limit': chatbot.reranking_limit,
-            'query': users_question,
-            'chunks': chunks,
-        }
-        response = requests.post(
-            url=settings.EMBEDDING_DB_URL,
-            json=data,
-            headers={'Authorization': f'Bearer {chatbot.api_key}'},
-            timeout=600,
-        )
-    except Exception as e:
-        logger.error(f'A non 200 response has occurred with the Embedding DB API service: {e}.')
-        return reranked_chunks
-
-    if response.status_code == 200:
-        reranked_chunks = response.json()['content']
-
+    reranked_chunks = await _apost(logger, chatbot.api_key, _rerank_data(chatbot, chunks, users_question))
     logger.info('Rerank Process End')
 
     return reranked_chunks
+
+
+async def _timed_retriever(name: str, retriever: Awaitable):
+    start = time.perf_counter()
+    result = await retriever
+    return name, result, time.perf_counter() - start
+
+
+async def gather_retrievers(retrievers: Dict[str, Awaitable], span=None) -> Dict[str, List]:
+    """
+    Run independent retrievers concurrently so retrieval takes as long as the slowest of them rather than their sum.
+    The time each retriever took is recorded on the supplied tracer span as `<name>_ms`.
+    """
+    logger = logging.getLogger('contact.vector.gather_retrievers')
+    results = {}
+    for name, result, elapsed in await asyncio.gather(
+        *(_timed_retriever(name, retriever) for name, retriever in retrievers.items()),
+    ):
+        logger.info(f'Retriever {name} took {elapsed:.3f}s')
+        if span is not None:
+            span.set_tag(f'{name}_ms', round(elapsed * 1000, 2))
+        results[name] = result
+    return results
+
+
+def normalise_query(query: str) -> str:
+    """
+    Normalise a question so trivially different phrasings (case, spacing) share retrieval cache entries
+    """
+    return ' '.join(str(query).lower().split()).rstrip('?!. ')
+
+
+def retrieval_settings(chatbot) -> Tuple:
+    """
+    The Chatbot settings that determine which chunks are retrieved for a query
+    """
+    return (
+        chatbot.api_key,
+        tuple(sorted(chatbot.corpus_names or [])),
+        chatbot.encoder,
+        chatbot.similarity,
+        str(chatbot.threshold),
+        chatbot.reference_limit,
+        chatbot.bm25_limit,
+        chatbot.apply_reranking,
+        chatbot.reranker if chatbot.apply_reranking else None,
+        chatbot.reranking_limit if chatbot.apply_reranking else None,
+    )
+
+
+def invalidate_retrieval_cache(corpus_names: Iterable[str]) -> int:
+    """
+    Remove the cached retrieval results of every query that searched any of the given corpora
+    """
+    corpus_names = set(corpus_names or [])
+    return RETRIEVAL_CACHE.delete_where(lambda key: bool(corpus_names.intersection(key[0][1])))
+
+
+register('retrieval', lambda corpus_name: invalidate_retrieval_cache([corpus_name]), RETRIEVAL_CACHE.clear)
+
+
+async def retrieve_chunks(chatbot, query: str, span=None) -> List:
+    """
+    Retrieve the chunks from the Chatbot's corpora that are used as references to answer the query
+    """
+    if not chatbot.corpus_names or len(chatbot.corpus_names) == 0:
+        return []
+
+    key = (retrieval_settings(chatbot), normalise_query(query))
+    top_chunks = RETRIEVAL_CACHE.get(key)
+    if span is not None:
+        span.set_tag('retrieval_cache_hit', top_chunks is not None)
+        for stat, value in RETRIEVAL_CACHE.stats().items():
+            span.set_tag(f'retrieval_cache_{stat}', value)
+    if top_chunks is not None:
+        return top_chunks
+
+    top_chunks = await _retrieve_chunks(chatbot, query, span)
+    # Empty results are not cached as the retrievers also return nothing when the Embedding DB API fails
+    if len(top_chunks) > 0:
+        RETRIEVAL_CACHE.set(key, top_chunks)
+    return top_chunks
+
+
+async def _retrieve_chunks(chatbot, query: str, span=None) -> List:
+    retrievers = {
+        'vector_similarity': async_vector_similarity(
+            chatbot.api_key,
+            chatbot.corpus_names,
+            chatbot.encoder,
+            query,
+            chatbot.similarity,
+            chatbot.reference_limit,
+            float(chatbot.threshold),
+        ),
+    }
+    if chatbot.apply_reranking:
+        # Keyword search over the whole corpus does not depend on the vector search so both run at the same time
+        retrievers['best_match_25'] = async_best_match_25(
+            chatbot.api_key,
+            chatbot.corpus_names,
+            None,
+            chatbot.bm25_limit,
+            query,
+        )
+    results = await gather_retrievers(retrievers, span=span)
+
+    chunks = [[hyperlink, chunk] for hyperlink, chunk, distance in results['vector_similarity']]
+    if chatbot.apply_reranking:
+        chunks.extend([item[0], item[1]] for item in results['best_match_25'])
+        chunk_set = list(set([tuple(item) for item in chunks]))
+        chunks = [list(item) for item in chunk_set]
+        return await async_rerank(chatbot, chunks, query)
+    if chatbot.bm25_limit > 0:
+        return await async_best_match_25(
+            chatbot.api_key,
+            None,
+            chunks,
+            chatbot.bm25_limit,
+            query,
+        )
+    return chunks
@@ -3,15 +3,25 @@ Management for Answer
 """
 import logging
 # stdlib
-import sys
+import asyncio
+import codecs
+import functools
 import re
+import time
 from copy import deepcopy
+from typing import Awaitable, Callable, Dict, List
 
 # libs
 from adrf.views import APIView
 from cloudcix_rest.exceptions import Http400, Http404
-import requests
 # local
+from contact.blobstore import store_images
+from contact.cache import AsyncTTLCache
+from contact.chatbot_cache import CHATBOT_CACHE
+from contact.clients import get_embedding_db_client, llm_client_stats
+from contact.database import database_stats, pool_stats, run_db
+from contact.history import append_turn, get_history
+from contact.images import ImageUploadHandler, aprocess_images, aprocess_uploaded_images
 from contact.intent import Intent, classify_intent
 from contact.llm import (
     ContactExceptionError,
@@ -24,9 +34,11 @@ from contact.llm import (
 from contact.models import Chatbot, Conversation, QAndA
 from contact.permissions.answer import Permissions
 from contact.safety import classify_safety
+from contact.semantic_cache import SEMANTIC_CACHE, content_tokens
 from contact.smalltalk import smalltalk
-from contact.utils import CustomStreamingHttpResponse
-from contact.vector import best_match_25, rerank, vector_similarity
+from contact.utils import CustomStreamingHttpResponse, coalesce_frames
+from contact.vector import normalise_query, retrieve_chunks
+from contact.write_behind import WRITE_BEHIND, write_behind_stats
 from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.http import StreamingHttpResponse
@@ -55,29 +67,207 @@ def _extract_urls(text):
     return URL_PATTERN.findall(text)
 
 
-def _extract_corpus_urls(api_key, corpus_names):
+# Longest text that is not a URL_PATTERN match yet but can grow into one
+URL_CARRY_OVER = len('https://')
+
+
+class StreamingURLDetector:
+    """
+    Find the URLs in text that arrives in pieces, as URL_PATTERN.findall would on the whole text.
+    A small tail of the scanned text is carried over to the next piece so URLs split across pieces are found once
+    they are complete.
+    """
+
+    def __init__(self):
+        self.carry = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+
+    def feed(self, piece) -> List[str]:
+        """
+        Scan the next piece of text, str or utf-8 bytes, and return the URLs completed by it
+        """
+        if isinstance(piece, (bytes, bytearray)):
+            piece = self._decoder.decode(piece)
+        text = self.carry + piece
+        urls = []
+        carry_start = max(0, len(text) - URL_CARRY_OVER)
+        for match in URL_PATTERN.finditer(text):
+            if match.end() == len(text):
+                # The URL may continue in the next piece
+                carry_start = match.start()
+                break
+            urls.append(match.group())
+            carry_start = max(carry_start, match.end())
+        self.carry = text[carry_start:]
+        return urls
+
+    def close(self) -> List[str]:
+        """
+        Return the URLs at the very end of the text, once no more pieces will arrive
+        """
+        text, self.carry = self.carry + self._decoder.decode(b'', final=True), ''
+        return URL_PATTERN.findall(text)
+
+
+# Normalised set of source URLs per (api_key, corpus name), used by the hallucination check
+CORPUS_URL_CACHE = AsyncTTLCache(
+    'corpus_urls',
+    maxsize=getattr(settings, 'CORPUS_URL_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'CORPUS_URL_CACHE_TTL', 300),
+    stale_ttl=getattr(settings, 'CORPUS_URL_CACHE_STALE_TTL', 3600),
+)
+
+
+async def _fetch_corpus_urls(api_key, corpus_name):
+    logger = logging.getLogger('contact.views.answer._fetch_corpus_urls')
+    url = f'{settings.EMBEDDING_DB_URL}/corpus/{corpus_name}/sources'
+    headers = {
+        'Accept': 'application/json',
+    }
+    if api_key:
+        headers['Authorization'] = f'Bearer {api_key}'
+    try:
+        resp = await get_embedding_db_client().get(url, headers=headers, timeout=10)
+        sources = resp.json().get('content', [])
+    except Exception as e:
+        logger.error(f'Could not retrieve the sources of Corpus {corpus_name} from the Embedding DB API: {e}.')
+        return None
+
+    urls = set()
+    for source in sources:
+        urls.update(_extract_urls(source))
+    return frozenset(url for url in urls if url)
+
+
+async def _extract_corpus_urls(api_key, corpus_names):
     if not corpus_names:
         return set()
 
-    all_urls = []
-    for corpus_name in corpus_names:
-        url = f'{settings.EMBEDDING_DB_URL}/corpus/{corpus_name}/sources'
+    corpus_urls = await asyncio.gather(*(
+        CORPUS_URL_CACHE.get_or_fetch(
+            (api_key, corpus_name),
+            functools.partial(_fetch_corpus_urls, api_key, corpus_name),
+        )
+        for corpus_name in corpus_names
+    ))
+    urls = set()
+    for corpus_url_set in corpus_urls:
+        urls.update(corpus_url_set or ())
+    return urls
+
+
+class SpeculativeRetrievalStats:
+    """
+    How often the chunks retrieved for the original question while it was being rewritten could be used
+    """
+
+    def __init__(self):
+        self.attempts = 0
+        self.paid_off = 0
+
+    def record(self, paid_off: bool):
+        self.attempts += 1
+        if paid_off:
+            self.paid_off += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'attempts': self.attempts,
+            'paid_off': self.paid_off,
+            'hit_rate': round(self.paid_off / self.attempts, 4) if self.attempts else 0.0,
+        }
+
+
+SPECULATIVE_RETRIEVAL = SpeculativeRetrievalStats()
+
+
+def _discard(task: asyncio.Task):
+    """
+    Cancel a task whose result is not needed, or retrieve its exception if it has already failed so it is not logged
+    """
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+def _rewrite_is_similar(question: str, rewritten_question: str) -> bool:
+    """
+    Whether the chunks retrieved for the question can be used for its rewrite. Rewriting mostly adds the names and
+    places the question refers to from the Conversation, which change what should be retrieved however similar the
+    rest of the question is, so the rewrite may only reorder or drop words of the question, not add any.
+    """
+    if normalise_query(question) == normalise_query(rewritten_question):
+        return True
+    return content_tokens(rewritten_question) <= content_tokens(question)
+
+
+class Preprocessing:
+    """
+    The pre-processing LLM calls made for a question before retrieval: safety classification, intent classification
+    and prompt rewriting, by name.
+    Normally each call is only made when its result is asked for, one after the other. With speculative set every call
+    is started straight away, and calls whose result can no longer be used are cancelled as soon as that is known:
+    all of them when the question is unsafe and the rewrite when the question is smalltalk. How long each call took,
+    which finished first and which were cancelled are tagged on span.
+    """
+
+    def __init__(self, calls: Dict[str, Callable[[], Awaitable]], span, speculative: bool = False):
+        self.calls = calls
+        self.span = span
+        self.speculative = speculative
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.first_completed = None
+        self.started = time.perf_counter()
+        if speculative:
+            for name, call in calls.items():
+                task = asyncio.ensure_future(call())
+                task.add_done_callback(functools.partial(self._done, name))
+                self.tasks[name] = task
+        span.set_tag('preprocessing_speculative', speculative)
+
+    def _done(self, name: str, task: asyncio.Task):
+        if task.cancelled():
+            self.span.set_tag(f'preprocessing_{name}_cancelled', True)
+            return
+        self.span.set_tag(f'preprocessing_{name}_ms', round((time.perf_counter() - self.started) * 1000, 3))
+        if self.first_completed is None:
+            self.first_completed = name
+            self.span.set_tag('preprocessing_first_completed', name)
+        if task.exception() is not None:
+            return
+        if name == 'safety' and not task.result():
+            self.cancel()
+        elif name == 'intent' and task.result() == Intent.SMALLTALK:
+            self.cancel('rewrite')
+
+    async def result(self, name: str):
+        """
+        Wait for the result of the named call. If the call fails everything still running is cancelled, as the
+        question will not be answered.
+        """
         try:
-            headers = {
-                'Accept': 'application/json',
-            }
-            if api_key:
-                headers['Authorization'] = f'Bearer {api_key}'
-
-            resp = requests.get(url, headers=headers, timeout=10)
-            all_urls.extend(resp.json().get('content', []))
+            if self.speculative:
+                return await self.tasks[name]
+            return await self.calls[name]()
         except Exception:
-            continue
+            self.cancel()
+            raise
 
-    urls = set()
-    for url in all_urls:
-        urls.update(_extract_urls(url))
-    return {url for url in urls if url}
+    def cancel(self, *names: str):
+        """
+        Cancel the named calls, or all calls, that are still running
+        """
+        for name, task in self.tasks.items():
+            if (len(names) == 0 or name in names) and not task.done():
+                task.cancel()
+
+    def decided(self, by: str):
+        """
+        Record the step whose result decided how the question is answered and cancel any calls still running
+        """
+        self.span.set_tag('preprocessing_decided_by', by)
+        self.cancel()
 
 
 class AnswerCollection(APIView):
@@ -93,69 +283,104 @@ class AnswerCollection(APIView):
         users_images=[],
         chatbot=None,
         similar_chunks=None,
+        first_turn_started=None,
     ):
         logger = logging.getLogger('contact.views.answer.streaming_answer')
         logger.info('Streaming Answer Process Start')
-        answer_content = ''
-        answer_text = ''
+        answer_frames = []
         response_is_bytes = False
+        # URLs in the answer are checked as they are streamed, against the URLs of the chunks straight away and
+        # against the URLs of the Corpora, fetched while the answer streams, once they are known
+        corpus_urls_task = None
+        chunk_urls = set()
+        unchecked_urls = set()
+        url_detector = StreamingURLDetector()
+        if chatbot is not None:
+            corpus_urls_task = asyncio.ensure_future(_extract_corpus_urls(
+                getattr(chatbot, 'api_key', None),
+                getattr(chatbot, 'corpus_names', None),
+            ))
+            for chunk in similar_chunks or []:
+                if not chunk:
+                    continue
+                chunk_urls.update(_extract_urls(str(chunk[1])))
+
+        def check_urls(urls):
+            unchecked_urls.update(url for url in urls if url not in chunk_urls)
+            if len(unchecked_urls) > 0 and corpus_urls_task.done():
+                unchecked_urls.difference_update(corpus_urls_task.result())
+
+        frames = coalesce_frames(
+            response,
+            max_size=getattr(settings, 'ANSWER_FRAME_MAX_SIZE', 512),
+            max_delay=getattr(settings, 'ANSWER_FRAME_MAX_DELAY', 0.05),
+            first_frame_immediate=getattr(settings, 'ANSWER_FRAME_FIRST_IMMEDIATE', True),
+        )
+        streamed = False
         try:
-            async for ans in response:
-                answer_content += str(ans)
-                if isinstance(ans, (bytes, bytearray)):
+            async for frame in frames:
+                if isinstance(frame, (bytes, bytearray)):
                     response_is_bytes = True
-                    answer_text += ans.decode('utf-8', errors='ignore')
-                else:
-                    answer_text += str(ans)
-                yield ans
-                sys.stdout.flush()
+                answer_frames.append(frame)
+                yield frame
+                if corpus_urls_task is not None:
+                    check_urls(url_detector.feed(frame))
+            streamed = True
         except ContactExceptionError:
             logger = logging.getLogger('contact.views.answer.streaming_answer')
             logger.error('LLM Error occurred while getting answer from chatbot LLM.')
             yield 'An unknown error has occurred, please try again later.'
-            sys.stdout.flush()
             return
         except Exception as e:  # pragma: no cover
             logger = logging.getLogger('contact.views.answer.streaming_answer')
             logger.error(f'An unknown error has occurred while streaming the answer. Exception: {e}')
             yield 'An unknown error has occurred, please try again later.'
-            sys.stdout.flush()
             return
+        finally:
+            if corpus_urls_task is not None and not streamed:
+                corpus_urls_task.cancel()
 
-        if chatbot is not None:
-            corpus_urls = await sync_to_async(_extract_corpus_urls, thread_sensitive=True)(
-                getattr(chatbot, 'api_key', None),
-                getattr(chatbot, 'corpus_names', None),
-            )
-            chunk_urls = set()
-            for chunk in similar_chunks or []:
-                if not chunk:
-                    continue
-                chunk_urls.update(_extract_urls(str(chunk[1])))
-
-            answer_urls = set(_extract_urls(answer_text))
-            missing_urls = [
-                url for url in answer_urls
-                if url not in corpus_urls and url not in chunk_urls
-            ]
-            if missing_urls:
+        if response_is_bytes:
+            answer_content = b''.join(answer_frames).decode('utf-8', errors='ignore')
+        else:
+            answer_content = ''.join(answer_frames)
+
+        hallucinated = False
+        if corpus_urls_task is not None:
+            check_urls(url_detector.close())
+            if len(unchecked_urls) > 0:
+                unchecked_urls.difference_update(await corpus_urls_task)
+            elif not corpus_urls_task.done():
+                corpus_urls_task.cancel()
+            if len(unchecked_urls) > 0:
+                hallucinated = True
                 if response_is_bytes:
                     yield HALLUCINATION_SENTINEL.encode('utf-8')
                 else:
                     yield HALLUCINATION_SENTINEL
-                sys.stdout.flush()
 
-        logger.warning('Creating QAndA record after streaming answer.')
-        await sync_to_async(QAndA.objects.create, thread_sensitive=True)(
+        # With a blob store configured only references to the images are kept in the QAndA record
+        question_images = await sync_to_async(store_images, thread_sensitive=False)(users_images)
+        q_and_a = QAndA(
             answer=answer_content,
             conversation=conversation,
             question=users_question,
-            question_images=users_images,
+            question_images=question_images,
         )
-        logger.warning('QAndA record created successfully after streaming answer.')
         conversation.last_message_at = timezone.now()
-        await sync_to_async(conversation.save, thread_sensitive=True)(update_fields=['last_message_at'])
-        logger.warning(f'Updated Conversation {conversation.id} last_message_at to {conversation.last_message_at}')
+        if getattr(settings, 'WRITE_BEHIND_ENABLED', True):
+            # Saved in the background so the response can close without waiting on the database
+            await WRITE_BEHIND.put(q_and_a, conversation)
+            logger.info(f'Queued QAndA record for Conversation {conversation.id} to be saved.')
+        else:
+            logger.warning('Creating QAndA record after streaming answer.')
+            await run_db(q_and_a.save)
+            logger.warning('QAndA record created successfully after streaming answer.')
+            await run_db(conversation.save, update_fields=['last_message_at'])
+            logger.warning(f'Updated Conversation {conversation.id} last_message_at to {conversation.last_message_at}')
+        append_turn(conversation, users_question, answer_content, question_images)
+        if first_turn_started is not None and not hallucinated:
+            SEMANTIC_CACHE.add(chatbot.pk, users_question, answer_content, time.perf_counter() - first_turn_started)
         logger.info('Streaming Answer Process End')
 
     @staticmethod
@@ -163,7 +388,31 @@ class AnswerCollection(APIView):
         response = ['An', 'unknown', 'error', 'has', 'occurred,', 'please', 'try', 'again', 'later.']
         for ans in response:
             yield ans
-            sys.stdout.flush()
+
+    @staticmethod
+    async def rewrite_question(chatbot, conversation, users_question, rewrite_prompt_system):
+        """
+        Rewrite the question with the Chatbot's rewrite prompt and the history of the Conversation
+        """
+        conversation_history = await run_db(
+            get_history,
+            conversation,
+            chatbot.maximum_conversation_turn or getattr(settings, 'LLM_HISTORY_TURNS', 20),
+        )
+        conversation_history_str = ''.join(turn.rewrite_line() for turn in conversation_history)
+        rewrite_messages = create_prompt_rewrite_messages(
+            conversation_history_str,
+            users_question,
+            chatbot_system_prompt=chatbot.system_prompt or '',
+            chatbot_context_prompt=chatbot.user_prompt or '',
+            rewrite_prompt_system=rewrite_prompt_system,
+        )
+        rewrite_result = await llm_rewrite_prompt(
+            chatbot,
+            rewrite_messages,
+            original_question=users_question,
+        )
+        return rewrite_result['rewritten_question']
 
     async def post(self, request: Request, chatbot_name: str) -> Response:
         """
@@ -177,6 +426,10 @@ class AnswerCollection(APIView):
             1. question: String to be answered
             2. conversation_id: The ID of the Conversation which must be in the Chatbot
 
+            Images can be sent with the question either as an "images" array of [base64 image, mime type, name] items
+            in a JSON body, or as "images" files in a multipart/form-data body. Each uploaded file can be at most
+            IMAGE_UPLOAD_MAX_SIZE bytes.
+
         path_params:
             chatbot_name:
                 description: The name of the Chatbot to Answer question.
@@ -193,7 +446,11 @@ class AnswerCollection(APIView):
             403: {}
             404: {}
         """
+        started = time.perf_counter()
         tracer = settings.TRACER
+        # Uploaded images are spooled to temporary files as they arrive, never held in memory whole
+        upload_handler = ImageUploadHandler(request._request)
+        request._request.upload_handlers = [upload_handler]
         data = request.data
 
         with tracer.start_span('checking_permissions', child_of=request.span):
@@ -201,22 +458,37 @@ class AnswerCollection(APIView):
             if err is not None:
                 return err
 
-        with tracer.start_span('retrieving_requested_object', child_of=request.span):
+        with tracer.start_span('retrieving_requested_object', child_of=request.span) as span:
             try:
-                chatbot = await sync_to_async(Chatbot.objects.get, thread_sensitive=True)(name=chatbot_name)
+                chatbot = await CHATBOT_CACHE.aget(name=chatbot_name)
             except Chatbot.DoesNotExist:
                 return Http404(error_code='contact_answer_create_001')
+            for stat, value in CHATBOT_CACHE.stats().items():
+                span.set_tag(f'chatbot_cache_{stat}', value)
 
         with tracer.start_span('checking_for_required_fields', child_of=request.span):
             if 'question' not in data or 'conversation_id' not in data:
                 return Http400(error_code='contact_answer_create_002')
 
+            if len(upload_handler.oversized) > 0:
+                return Http400(error_code='contact_answer_create_004')
+
             users_question = data['question']
-            users_images = data.get('images', [])
+            uploaded_images = request.FILES.getlist('images')
+            users_images = [] if len(uploaded_images) > 0 else data.get('images', [])
+
+        with tracer.start_span('processing_images', child_of=request.span) as span:
+            span.set_tag('num_images', len(uploaded_images) or len(users_images or []))
+            span.set_tag('multipart', len(uploaded_images) > 0)
+            if len(uploaded_images) > 0:
+                users_images = await aprocess_uploaded_images(uploaded_images)
+            else:
+                users_images = await aprocess_images(users_images)
 
         with tracer.start_span('validate_conversation_id', child_of=request.span):
             try:
-                conversation = await sync_to_async(Conversation.objects.get, thread_sensitive=True)(
+                conversation = await run_db(
+                    Conversation.objects.get,
                     pk=data['conversation_id'],
                     chatbot=chatbot,
                 )
@@ -237,16 +509,38 @@ class AnswerCollection(APIView):
                     content_type='application/json; charset=utf-8',
                 )
 
+        rewrite_prompt_system = getattr(chatbot, 'rewrite_prompt', '') or ''
+        calls = {}
+        if chatbot.apply_safety_classifier:
+            calls['safety'] = functools.partial(classify_safety, chatbot, users_question)
+        if chatbot.apply_intent_classification:
+            calls['intent'] = functools.partial(classify_intent, chatbot, conversation, users_question)
+        if getattr(chatbot, 'apply_prompt_rewriting', False) and rewrite_prompt_system:
+            calls['rewrite'] = functools.partial(
+                self.rewrite_question,
+                chatbot,
+                conversation,
+                users_question,
+                rewrite_prompt_system,
+            )
+        preprocessing = Preprocessing(
+            calls,
+            request.span,
+            speculative=len(calls) > 1 and getattr(settings, 'ANSWER_SPECULATIVE_PREPROCESSING', False),
+        )
+
         if chatbot.apply_safety_classifier:
             with tracer.start_span('safety_classification', child_of=request.span):
                 try:
-                    is_safe = await classify_safety(chatbot, users_question)
+                    is_safe = await preprocessing.result('safety')
                 except ContactExceptionError:  # pragma: no cover
                     return CustomStreamingHttpResponse(
                         self.streaming_error_response(),
                         content_type='text/event-stream; charset=utf-8',
                     )
             if not is_safe:
+                preprocessing.decided('safety')
+
                 async def streaming_safety_answer():
                     safety_response = 'Your question has been flagged as unsafe and cannot be answered.'
                     for ans in safety_response.split():
@@ -257,16 +551,48 @@ class AnswerCollection(APIView):
                     content_type='application/json; charset=utf-8',
                 )
 
+        first_turn_started = None
+        if chatbot.semantic_cache_threshold > 0 and not users_images:
+            with tracer.start_span('semantic_cache_lookup', child_of=request.span) as span:
+                # Read from the history cache, which already holds turns that write behind has not saved yet
+                is_first_turn = len(await run_db(get_history, conversation, 1)) == 0
+                if is_first_turn:
+                    first_turn_started = started
+                    cached_answer = await run_db(
+                        SEMANTIC_CACHE.lookup,
+                        chatbot,
+                        users_question,
+                    )
+                    span.set_tag('semantic_cache_hit', cached_answer is not None)
+                    for stat, value in SEMANTIC_CACHE.stats().items():
+                        span.set_tag(f'semantic_cache_{stat}', value)
+                    if cached_answer is not None:
+                        preprocessing.decided('semantic_cache')
+                        # The Chatbot is passed so the URLs of the cached answer are checked again, against its
+                        # corpora as there are no chunks
+                        return CustomStreamingHttpResponse(
+                            self.streaming_answer(
+                                async_list_to_generator(re.findall(r'\S+|\s+', cached_answer)),
+                                conversation,
+                                users_question,
+                                users_images,
+                                chatbot=chatbot,
+                                similar_chunks=[],
+                            ),
+                            content_type='text/event-stream; charset=utf-8',
+                        )
+
         if chatbot.apply_intent_classification:
             with tracer.start_span('classify_intent', child_of=request.span):
                 try:
-                    intent = await classify_intent(chatbot, conversation, users_question)
+                    intent = await preprocessing.result('intent')
                 except ContactExceptionError:  # pragma: no cover
                     return CustomStreamingHttpResponse(
                         self.streaming_error_response(),
                         content_type='text/event-stream; charset=utf-8',
                     )
             if intent == Intent.SMALLTALK:
+                preprocessing.decided('intent')
                 with tracer.start_span('get_smalltalk_answer_from_chatbot_llm', child_of=request.span):
                     try:
                         # NOTE: deepcopy chatbot to override fields used in llm.py:
@@ -274,7 +600,8 @@ class AnswerCollection(APIView):
                         smalltalk_chatbot = deepcopy(chatbot)
                         smalltalk_chatbot.system_prompt = smalltalk_chatbot.smalltalk_prompt
                         smalltalk_chatbot.user_prompt = None
-                        prompt = await sync_to_async(create_prompt, thread_sensitive=True)(
+                        prompt = await run_db(
+                            create_prompt,
                             conversation,
                             chatbot,
                             [],
@@ -305,90 +632,55 @@ class AnswerCollection(APIView):
                         )
 
         rewritten_question = users_question
-        rewrite_prompt_system = getattr(chatbot, 'rewrite_prompt', '') or ''
-        if getattr(chatbot, 'apply_prompt_rewriting', False) and rewrite_prompt_system:
+        speculative_chunks = None
+        if 'rewrite' in calls:
+            if getattr(settings, 'ANSWER_SPECULATIVE_RETRIEVAL', True):
+                # Most rewrites leave the question (nearly) as it is, so retrieve for the original while it is rewritten
+                speculative_chunks = asyncio.ensure_future(retrieve_chunks(chatbot, users_question))
             with tracer.start_span('rewrite_prompt', child_of=request.span):
                 try:
-                    conversation_history = await sync_to_async(
-                        lambda: list(
-                            QAndA.objects.filter(conversation=conversation)
-                            .order_by('-created')
-                            .values_list('question', 'answer'),
-                        ),
-                        thread_sensitive=True,
-                    )()
-                    conversation_history_str = ''
-                    for question, answer in conversation_history:
-                        conversation_history_str += f'User: {question}\nChatbot: {answer}\n'
-                    rewrite_messages = create_prompt_rewrite_messages(
-                        conversation_history_str,
-                        users_question,
-                        chatbot_system_prompt=chatbot.system_prompt or '',
-                        chatbot_context_prompt=chatbot.user_prompt or '',
-                        rewrite_prompt_system=rewrite_prompt_system,
-                    )
-                    rewrite_result = await llm_rewrite_prompt(
-                        chatbot,
-                        rewrite_messages,
-                        original_question=users_question,
-                    )
-                    rewritten_question = rewrite_result['rewritten_question']
+                    rewritten_question = await preprocessing.result('rewrite')
                 except ContactExceptionError:  # pragma: no cover
+                    if speculative_chunks is not None:
+                        _discard(speculative_chunks)
                     return CustomStreamingHttpResponse(
                         self.streaming_error_response(),
                         content_type='text/event-stream; charset=utf-8',
                     )
-
-        # testing the vector similarity function in vector.py file related to answer service
-        if chatbot.corpus_names and len(chatbot.corpus_names) > 0:
-            with tracer.start_span('getting_similiar_chunks', child_of=request.span):
-                similar_chunks = vector_similarity(
-                    chatbot.api_key,
-                    chatbot.corpus_names,
-                    chatbot.encoder,
-                    rewritten_question,
-                    chatbot.similarity,
-                    chatbot.reference_limit,
-                    float(chatbot.threshold),
-                )
-                chunks = []
-                for item in similar_chunks:
-                    hyperlink, chunk, distance = item
-                    chunks.append([hyperlink, chunk])
-
-                if chatbot.apply_reranking:
-                    bm25_chunks = best_match_25(
-                        chatbot.api_key,
-                        chatbot.corpus_names,
-                        None,
-                        chatbot.bm25_limit,
-                        rewritten_question,
-                    )
-                    for item in bm25_chunks:
-                        chunks.append([item[0], item[1]])
-                    chunk_set = list(set([tuple(item) for item in chunks]))
-                    chunks = [list(item) for item in chunk_set]
-                    top_chunks = rerank(chatbot, chunks, rewritten_question)
-                elif chatbot.bm25_limit > 0:
-                    top_chunks = best_match_25(
-                        chatbot.api_key,
-                        None,
-                        chunks,
-                        chatbot.bm25_limit,
-                        rewritten_question,
-                    )
+        preprocessing.decided('rewrite' if 'rewrite' in calls else 'none')
+
+        with tracer.start_span('getting_similiar_chunks', child_of=request.span) as span:
+            top_chunks = None
+            if speculative_chunks is not None:
+                paid_off = _rewrite_is_similar(users_question, rewritten_question)
+                SPECULATIVE_RETRIEVAL.record(paid_off)
+                span.set_tag('speculative_retrieval_used', paid_off)
+                for stat, value in SPECULATIVE_RETRIEVAL.stats().items():
+                    span.set_tag(f'speculative_retrieval_{stat}', value)
+                if paid_off:
+                    top_chunks = await speculative_chunks
                 else:
-                    top_chunks = chunks
-        else:
-            top_chunks = []
-
-        with tracer.start_span('getting_answer_from_chatbot_llm', child_of=request.span):
-            prompt = await sync_to_async(create_prompt, thread_sensitive=True)(
+                    _discard(speculative_chunks)
+            if top_chunks is None:
+                top_chunks = await retrieve_chunks(chatbot, rewritten_question, span=span)
+
+        with tracer.start_span('getting_answer_from_chatbot_llm', child_of=request.span) as span:
+            for stat, value in llm_client_stats().items():
+                span.set_tag(f'llm_client_pool_{stat}', value)
+            for stat, value in write_behind_stats().items():
+                span.set_tag(f'write_behind_{stat}', value)
+            for stat, value in database_stats().items():
+                span.set_tag(f'database_{stat}', value)
+            for stat, value in pool_stats().items():
+                span.set_tag(f'database_pool_{stat}', value)
+            prompt = await run_db(
+                create_prompt,
                 conversation,
                 chatbot,
                 top_chunks,
                 users_question,
                 users_images,
+                span=span,
             )
             # Fallback: if there are no similar/reference chunks and chatbot.no_reference_answer is set
             if len(top_chunks) == 0 and bool(getattr(chatbot, 'no_reference_answer', '')):
@@ -414,6 +706,7 @@ class AnswerCollection(APIView):
                             users_images,
                             chatbot=chatbot,
                             similar_chunks=top_chunks,
+                            first_turn_started=first_turn_started,
                         ),
                         content_type='text/event-stream; charset=utf-8',
                     )
@@ -7,6 +7,7 @@ import bcrypt
 from cloudcix_rest.exceptions import Http400, Http404
 from cloudcix_rest.views import APIView
 # local
+from contact.chatbot_cache import CHATBOT_CACHE
 from contact.models import Chatbot, Contact
 from contact.permissions.auth import Permissions
 from django.conf import settings
@@ -63,7 +64,7 @@ class AuthResource(APIView):
 
         with tracer.start_span('retrieving_requested_object', child_of=request.span):
             try:
-                obj = Chatbot.objects.get(name=chatbot_name)
+                obj = CHATBOT_CACHE.get(name=chatbot_name)
             except Chatbot.DoesNotExist:
                 return Http404(error_code='contact_auth_create_001')
 
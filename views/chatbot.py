@@ -14,10 +14,13 @@ from rest_framework import status
 from rest_framework.request import Request
 from rest_framework.response import Response
 # local
+from contact.chatbot_cache import chatbot_keys
 from contact.controllers import ChatbotListController, ChatbotCreateController, ChatbotUpdateController
+from contact.invalidation import publish
 from contact.models import Chatbot
 from contact.permissions.chatbot import Permissions
 from contact.serializers import ChatbotSerializer
+from contact.vector import retrieval_settings
 
 
 __all__ = [
@@ -206,6 +209,8 @@ class ChatbotResource(APIView):
                 obj = Chatbot.objects.get(id=pk, member_id=request.user.member['id'])
             except Chatbot.DoesNotExist:
                 return Http404(error_code='contact_chatbot_update_001')
+            previous_retrieval_settings = retrieval_settings(obj)
+            previous_name = obj.name
 
         with tracer.start_span('validating_controller', child_of=request.span) as span:
             controller = ChatbotUpdateController(
@@ -225,6 +230,14 @@ class ChatbotResource(APIView):
             # Refresh after saving
             controller.instance.refresh_from_db()
 
+        with tracer.start_span('invalidating_cached_results', child_of=request.span):
+            keys = chatbot_keys(controller.instance, previous_name)
+            keys += [f'response:{controller.instance.pk}', f'semantic:{controller.instance.pk}']
+            if retrieval_settings(controller.instance) != previous_retrieval_settings:
+                corpus_names = set(previous_retrieval_settings[1]) | set(controller.instance.corpus_names or [])
+                keys += [f'retrieval:{corpus_name}' for corpus_name in sorted(corpus_names)]
+            publish(*keys)
+
         with tracer.start_span('Serializing_data', child_of=request.span):
             data = ChatbotSerializer(instance=controller.instance).data
 
@@ -265,4 +278,11 @@ class ChatbotResource(APIView):
         with tracer.start_span('deleting_object', child_of=request.span):
             obj.cascade_delete()
 
+        with tracer.start_span('invalidating_cached_results', child_of=request.span):
+            publish(
+                f'response:{obj.pk}',
+                f'semantic:{obj.pk}',
+                *[f'retrieval:{corpus_name}' for corpus_name in obj.corpus_names or []],
+            )
+
         return Response(status=status.HTTP_204_NO_CONTENT)
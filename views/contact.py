@@ -16,6 +16,8 @@ from contact.controllers import (
     ContactListController,
     ContactUpdateController,
 )
+from contact.db_router import replica_reads
+from contact.invalidation import publish
 from contact.models import Contact, Chatbot
 from contact.permissions.contact import Permissions
 from contact.serializers import ContactSerializer
@@ -30,6 +32,7 @@ class ContactCollection(APIView):
     """
     Handles methods regarding Contact records that do not require an id to be specified, i.e. list, create
     """
+    @replica_reads()
     def get(self, request: Request) -> Response:
         """
         summary: Retrieve a list of Contact records
@@ -214,6 +217,9 @@ class ContactResource(APIView):
         with tracer.start_span('saving_object', child_of=request.span):
             controller.instance.save()
 
+        with tracer.start_span('invalidating_cached_results', child_of=request.span):
+            publish(f'contact:{controller.instance.pk}')
+
         with tracer.start_span('Serializing_data', child_of=request.span):
             data = ContactSerializer(instance=controller.instance).data
         return Response({'content': data}, status=status.HTTP_200_OK)
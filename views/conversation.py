@@ -12,10 +12,12 @@ from rest_framework import status
 from rest_framework.request import Request
 from rest_framework.response import Response
 # local
+from contact.chatbot_cache import CHATBOT_CACHE
 from contact.controllers import (
     ConversationListController,
     ConversationCreateController,
 )
+from contact.db_router import replica_reads
 from contact.models import Chatbot, Conversation
 from contact.permissions.conversation import Permissions
 from contact.serializers import ConversationSerializer
@@ -31,6 +33,7 @@ class ConversationCollection(APIView):
     Handles methods regarding Conversation records that do not require an id to be specified, i.e. list
     """
 
+    @replica_reads()
     def get(self, request: Request, chatbot_name: str) -> Response:
         """
         summary: Retrieve a list of Conversation records
@@ -52,7 +55,7 @@ class ConversationCollection(APIView):
 
         with tracer.start_span('retrieving_requested_object', child_of=request.span):
             try:
-                obj = Chatbot.objects.get(name=chatbot_name)
+                obj = CHATBOT_CACHE.get(name=chatbot_name)
             except Chatbot.DoesNotExist:
                 return Http404(error_code='contact_conversation_list_001')
 
@@ -120,7 +123,7 @@ class ConversationCollection(APIView):
 
         with tracer.start_span('retrieving_requested_object', child_of=request.span):
             try:
-                obj = Chatbot.objects.get(name=chatbot_name)
+                obj = CHATBOT_CACHE.get(name=chatbot_name)
             except Chatbot.DoesNotExist:
                 return Http404(error_code='contact_conversation_create_001')
 
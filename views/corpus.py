@@ -12,6 +12,7 @@ from rest_framework.response import Response
 from contact.controllers import (
     CorpusListController,
 )
+from contact.db_router import replica_reads
 from contact.models import Chatbot, Corpus
 from contact.serializers import CorpusSerializer
 
@@ -24,6 +25,7 @@ class CorpusCollection(APIView):
     """
     Handles methods regarding Corpus records that do not require an id to be specified, i.e. list, create
     """
+    @replica_reads()
     def get(self, request: Request, chatbot_id: int) -> Response:
         """
         summary: Retrieve a list of Corpus records
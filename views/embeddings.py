@@ -9,6 +9,7 @@ from django.conf import settings
 from rest_framework.request import Request
 from rest_framework.response import Response
 # local
+from contact.chatbot_cache import CHATBOT_CACHE
 from contact.models import Chatbot
 from contact.vector import vector_similarity, best_match_25
 
@@ -54,7 +55,9 @@ class EmbeddingsResource(APIView):
 
         with tracer.start_span('retrieving_chatbot_object', child_of=request.span):
             try:
-                obj = Chatbot.objects.get(name=chatbot_name, id=pk, member_id=request.user.member['id'])
+                obj = CHATBOT_CACHE.get(name=chatbot_name)
+                if obj.pk != int(pk) or obj.member_id != request.user.member['id']:
+                    raise Chatbot.DoesNotExist
             except Chatbot.DoesNotExist:
                 return Http404(error_code='contact_embeddings_read_001')
 
@@ -6,6 +6,7 @@ from cloudcix_rest.exceptions import Http400, Http404
 from cloudcix_rest.views import APIView
 # local
 from contact.controllers import QAndACreateController, QAndAListController
+from contact.db_router import replica_reads
 from contact.models import Conversation, QAndA, Reference
 from contact.permissions.q_and_a import Permissions
 from contact.serializers import QAndASerializer
@@ -24,6 +25,7 @@ class QAndACollection(APIView):
     """
     Handles methods regarding QAndA records, i.e. list
     """
+    @replica_reads()
     def get(self, request: Request, chatbot_name: str, conversation_id: int) -> Response:
         """
         summary: Retrieve a list of QAndA records
@@ -6,6 +6,8 @@ Management for Summary
 from adrf.views import APIView
 from cloudcix_rest.exceptions import Http400, Http404, Http503
 # local
+from contact.chatbot_cache import CHATBOT_CACHE
+from contact.database import run_db
 from contact.llm import ContactExceptionError, llm_summary
 from contact.models import Chatbot, Contact, Conversation
 from contact.permissions.summary import Permissions
@@ -14,7 +16,6 @@ from django.conf import settings
 from rest_framework import status
 from rest_framework.request import Request
 from rest_framework.response import Response
-from asgiref.sync import sync_to_async
 
 __all__ = [
     'SummaryCollection',
@@ -62,7 +63,7 @@ class SummaryCollection(APIView):
 
         with tracer.start_span('retrieving_requested_object', child_of=request.span):
             try:
-                obj = await sync_to_async(Chatbot.objects.get, thread_sensitive=True)(name=chatbot_name)
+                obj = await CHATBOT_CACHE.aget(name=chatbot_name)
             except Chatbot.DoesNotExist:
                 return Http404(error_code='contact_summary_create_001')
 
@@ -76,10 +77,7 @@ class SummaryCollection(APIView):
         with tracer.start_span('validate_contact_id', child_of=request.span):
             if contact_id is not None:
                 try:
-                    await sync_to_async(
-                        Contact.objects.get,
-                        thread_sensitive=True,
-                    )(pk=data['contact_id'], member_id=obj.member_id)
+                    await run_db(Contact.objects.get, pk=data['contact_id'], member_id=obj.member_id)
                 except Contact.DoesNotExist:
                     return Http404(error_code='contact_summary_create_003')
 
@@ -100,15 +98,15 @@ class SummaryCollection(APIView):
                 return Http503(error_code='contact_summary_create_004')
 
         with tracer.start_span('creating_conversation', child_of=request.span):
-            conversation = await sync_to_async(
+            conversation = await run_db(
                 Conversation.objects.create,
-                thread_sensitive=True,
-            )(name=summary, chatbot=obj, contact_id=contact_id, cookie=cookie)
+                name=summary,
+                chatbot=obj,
+                contact_id=contact_id,
+                cookie=cookie,
+            )
 
         with tracer.start_span('serializing_conversation', child_of=request.span):
-            data = await sync_to_async(
-                lambda: ConversationSerializer(instance=conversation).data,
-                thread_sensitive=True,
-            )()
+            data = await run_db(lambda: ConversationSerializer(instance=conversation).data)
 
         return Response({'content': data}, status=status.HTTP_201_CREATED)
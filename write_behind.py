@@ -0,0 +1,187 @@
+# stdlib
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, NamedTuple
+# libs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.db.models import Q
+# local
+from contact.models import Conversation, QAndA
+
+__all__ = [
+    'WRITE_BEHIND',
+    'write_behind_stats',
+]
+
+
+class _Write(NamedTuple):
+    q_and_a: QAndA
+    conversation_id: int
+    last_message_at: object
+    enqueued_at: float
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of answered questions to persist after their answer has been streamed.
+    A writer thread saves them in batches: one bulk INSERT of the QAndA records and one UPDATE of last_message_at per
+    Conversation in the batch, in a single transaction. A failed batch is retried with backoff, and after the last
+    retry its records are saved one at a time so one bad record cannot lose the rest.
+    Whatever is still queued when the process exits is saved before it exits.
+    """
+
+    def __init__(self):
+        self.batch_size = getattr(settings, 'WRITE_BEHIND_BATCH_SIZE', 100)
+        self.flush_interval = getattr(settings, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.2)
+        self.max_retries = getattr(settings, 'WRITE_BEHIND_MAX_RETRIES', 5)
+        self.retry_delay = getattr(settings, 'WRITE_BEHIND_RETRY_DELAY', 0.5)
+        self._queue: 'queue.Queue[_Write]' = queue.Queue(maxsize=getattr(settings, 'WRITE_BEHIND_QUEUE_SIZE', 10000))
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        # How long the oldest record of the last batch waited between being queued and being saved
+        self.last_lag_seconds = 0.0
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='contact_write_behind', daemon=True)
+                self._thread.start()
+
+    async def put(self, q_and_a: QAndA, conversation: Conversation):
+        """
+        Queue the unsaved QAndA and the Conversation's new last_message_at to be saved. When the queue is full this
+        waits, off the event loop, for the writer to make room.
+        """
+        self._start()
+        write = _Write(q_and_a, conversation.pk, conversation.last_message_at, time.monotonic())
+        try:
+            self._queue.put_nowait(write)
+        except queue.Full:
+            logging.getLogger('contact.write_behind.put').warning('Write behind queue is full, waiting for room.')
+            await sync_to_async(self._queue.put, thread_sensitive=False)(write)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: List[_Write]):
+        logger = logging.getLogger('contact.write_behind.flush')
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            close_old_connections()
+            try:
+                self._write(batch)
+                break
+            except Exception as e:
+                self._reset(batch)
+                if attempt == self.max_retries:
+                    logger.error(
+                        f'Could not save a batch of {len(batch)} QAndA records, saving them one at a time: {e}',
+                    )
+                    self._write_each(batch)
+                    break
+                self.retries += 1
+                logger.warning(f'Could not save a batch of {len(batch)} QAndA records, retrying: {e}')
+                time.sleep(self.retry_delay * 2 ** attempt)
+        finished = time.monotonic()
+        self.flushes += 1
+        self.last_flush_seconds = finished - started
+        self.flush_seconds += self.last_flush_seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, self.last_flush_seconds)
+        self.last_lag_seconds = finished - min(write.enqueued_at for write in batch)
+
+    @staticmethod
+    def _reset(batch: List[_Write]):
+        # A rolled back bulk_create leaves the primary keys it was given on the records
+        for write in batch:
+            write.q_and_a.pk = None
+            write.q_and_a._state.adding = True
+
+    def _write(self, batch: List[_Write]):
+        last_message_at: Dict[int, object] = {}
+        for write in batch:
+            current = last_message_at.get(write.conversation_id)
+            if current is None or write.last_message_at > current:
+                last_message_at[write.conversation_id] = write.last_message_at
+
+        with transaction.atomic(using=router.db_for_write(QAndA)):
+            QAndA.objects.bulk_create([write.q_and_a for write in batch])
+            for conversation_id, timestamp in last_message_at.items():
+                # Never move last_message_at back if a later answer was saved by another worker first
+                Conversation.objects.filter(
+                    Q(last_message_at__isnull=True) | Q(last_message_at__lt=timestamp),
+                    pk=conversation_id,
+                ).update(last_message_at=timestamp)
+        self.written += len(batch)
+
+    def _write_each(self, batch: List[_Write]):
+        logger = logging.getLogger('contact.write_behind.write_each')
+        for write in batch:
+            try:
+                self._write([write])
+            except Exception as e:
+                self._reset([write])
+                self.failed += 1
+                logger.error(
+                    f'Could not save the QAndA record for Conversation {write.conversation_id}, it has been lost: {e}',
+                )
+
+    def stop(self, timeout: float = None):
+        """
+        Save everything still queued and stop the writer thread, waiting at most timeout seconds
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'depth': self._queue.qsize(),
+            'written': self.written,
+            'failed': self.failed,
+            'retries': self.retries,
+            'flushes': self.flushes,
+            'avg_flush_seconds': round(self.flush_seconds / self.flushes, 4) if self.flushes else 0.0,
+            'last_flush_seconds': round(self.last_flush_seconds, 4),
+            'max_flush_seconds': round(self.max_flush_seconds, 4),
+            'last_lag_seconds': round(self.last_lag_seconds, 4),
+        }
+
+
+WRITE_BEHIND = WriteBehindQueue()
+
+
+def write_behind_stats() -> Dict[str, float]:
+    return WRITE_BEHIND.stats()
+
+
+@atexit.register
+def _flush_at_exit():  # pragma: no cover
+    """
+    On interpreter shutdown, save the QAndA records that are still queued
+    """
+    WRITE_BEHIND.stop(getattr(settings, 'WRITE_BEHIND_SHUTDOWN_TIMEOUT', 30))